@@ -0,0 +1,323 @@
+import random
+import statistics
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from bedrock_agent_helper import BedrockAgent
+
+# Marks a stream that ended before producing its first chunk
+_NO_CHUNK = object()
+
+
+class RoutingError(Exception):
+    """Raised when no target could start streaming a turn."""
+
+
+class RouteTarget:
+    """A (region, model) pair with the rolling health statistics used to rank it."""
+    __slots__ = ('region_name', 'model_id', 'client', 'first_chunk_times', 'outcomes', 'cooldown_until')
+
+    def __init__(self, region_name: str, model_id: str, client: Any = None, window: int = 50):
+        """
+        Args:
+            region_name: AWS region of the target
+            model_id: model to invoke in that region
+            client: bedrock-agent-runtime client for the region, created if not given
+            window: number of recent turns the statistics are computed over
+        """
+        self.region_name = region_name
+        self.model_id = model_id
+        self.client = client if client is not None else BedrockAgent.create_client(region_name)
+        self.first_chunk_times = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)  # True for a failed turn
+        self.cooldown_until = 0.0
+
+    @property
+    def name(self) -> str:
+        return f"{self.region_name}/{self.model_id}"
+
+    @property
+    def error_rate(self) -> float:
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    @property
+    def median_first_chunk_time(self) -> Optional[float]:
+        return statistics.median(self.first_chunk_times) if self.first_chunk_times else None
+
+    def score(self, now: float, failed_latency: float) -> float:
+        """
+        Expected seconds to first chunk, inflated by the error rate. Lower is better.
+
+        Args:
+            now: current time.monotonic()
+            failed_latency: latency assumed for a target that has only ever failed
+        """
+        if now < self.cooldown_until:
+            return float('inf')
+        latency = self.median_first_chunk_time
+        if latency is None:
+            if not self.outcomes:
+                # Never tried; try it so it gets measured
+                return 0.0
+            latency = failed_latency
+        return latency * (1 + 4 * self.error_rate)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'target': self.name,
+            'median_first_chunk_ms': round(self.median_first_chunk_time * 1000, 1)
+            if self.first_chunk_times else None,
+            'error_rate': round(self.error_rate, 3),
+            'turns': len(self.outcomes),
+            'cooling_down': time.monotonic() < self.cooldown_until,
+        }
+
+
+class AgentRouter:
+    """
+    Routes invoke_inline_agent calls over a pool of (region, model) targets.
+
+    The router has the same invoke_inline_agent method as a bedrock-agent-runtime client, so it
+    can be passed to BedrockAgent as its client. Each new turn goes to the target with the best
+    rolling time to first chunk and error rate. If that target raises, or does not produce its
+    first chunk within first_chunk_timeout, the turn fails over to the next target. Once a
+    chunk has been streamed the turn stays where it is.
+
+    Calls returning control results continue a turn, so they go to the target that started it.
+    New turns of a session also go to the target its previous turn ran on, as long as that
+    target is not cooling down: Bedrock keeps session history per region, so a session moved to
+    another region continues without the history it had in the previous one.
+
+    First chunks are awaited on a pool of max_concurrency workers; size it to the number of
+    turns running at once. The first chunk timeout runs from when a worker starts the call, so
+    time spent waiting for a free worker is not blamed on the target.
+    """
+
+    def __init__(
+            self,
+            targets: Iterable[RouteTarget],
+            first_chunk_timeout: float = 10.0,
+            error_cooldown: float = 5.0,
+            throttle_cooldown: float = 30.0,
+            explore_rate: float = 0.05,
+            max_sessions: int = 100000,
+            max_concurrency: int = 32
+    ):
+        """
+        Args:
+            targets: the (region, model) targets to route over
+            first_chunk_timeout: seconds to wait for a target's first chunk before failing over
+            error_cooldown: seconds a target is skipped after an error or timeout
+            throttle_cooldown: seconds a target is skipped after it throttled a request
+            explore_rate: share of turns sent to a random healthy target, so stale statistics get refreshed
+            max_sessions: how many session-to-target pins to remember
+            max_concurrency: number of turns expected to start at once
+        """
+        self.targets = list(targets)
+        if not self.targets:
+            raise ValueError("AgentRouter needs at least one target")
+        self.first_chunk_timeout = first_chunk_timeout
+        self.error_cooldown = error_cooldown
+        self.throttle_cooldown = throttle_cooldown
+        self.explore_rate = explore_rate
+        self.max_sessions = max_sessions
+        self._session_targets: "OrderedDict[str, RouteTarget]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Waits for first chunks, so a stalled stream can be abandoned after the timeout. An
+        # abandoned call keeps its worker until the target answers, hence the headroom.
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency * 2, thread_name_prefix="router-first-chunk")
+
+    @property
+    def model_ids(self) -> List[str]:
+        """The distinct models a turn may be routed to."""
+        return sorted({target.model_id for target in self.targets})
+
+    @classmethod
+    def from_pool(cls, pool: Iterable[Tuple[str, str]], max_concurrency: int = 32, **kwargs) -> "AgentRouter":
+        """Create a router over (region, model id) pairs, with one client per region sized to max_concurrency."""
+        clients = {}
+        targets = []
+        for region_name, model_id in pool:
+            if region_name not in clients:
+                clients[region_name] = BedrockAgent.create_client(region_name, max_pool_connections=max_concurrency)
+            targets.append(RouteTarget(region_name, model_id, clients[region_name]))
+        return cls(targets, max_concurrency=max_concurrency, **kwargs)
+
+    def rank_targets(self) -> List[RouteTarget]:
+        """Targets in the order a new turn tries them."""
+        now = time.monotonic()
+        with self._lock:
+            scores = {target.name: target.score(now, self.first_chunk_timeout) for target in self.targets}
+        ranked = sorted(self.targets, key=lambda target: scores[target.name])
+        healthy = [target for target in ranked if scores[target.name] != float('inf')]
+        if len(healthy) > 1 and random.random() < self.explore_rate:
+            explored = random.choice(healthy[1:])
+            ranked.remove(explored)
+            ranked.insert(0, explored)
+        return ranked
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [target.stats() for target in self.targets]
+
+    def _record_first_chunk(self, target: RouteTarget, first_chunk_time: float) -> None:
+        with self._lock:
+            target.first_chunk_times.append(first_chunk_time)
+
+    def _record_success(self, target: RouteTarget) -> None:
+        with self._lock:
+            target.outcomes.append(False)
+
+    def _record_failure(self, target: RouteTarget, error: BaseException) -> None:
+        throttled = 'Throttl' in type(error).__name__ or 'Throttl' in str(error)
+        with self._lock:
+            target.outcomes.append(True)
+            target.cooldown_until = time.monotonic() + (self.throttle_cooldown if throttled else self.error_cooldown)
+
+    def _pin_session(self, session_id: Optional[str], target: RouteTarget) -> None:
+        if session_id is None:
+            return
+        with self._lock:
+            self._session_targets[session_id] = target
+            self._session_targets.move_to_end(session_id)
+            while len(self._session_targets) > self.max_sessions:
+                self._session_targets.popitem(last=False)
+
+    def _start(self, target: RouteTarget, kwargs: Dict[str, Any],
+               started: threading.Event) -> Tuple[Dict[str, Any], Iterator, Any]:
+        """Invoke a target and wait for its first chunk, both on a worker thread."""
+        started.set()
+        response = target.client.invoke_inline_agent(**dict(kwargs, foundationModel=target.model_id))
+        stream = iter(response['completion'])
+        return response, stream, next(stream, _NO_CHUNK)
+
+    def invoke_inline_agent(self, **kwargs) -> Dict[str, Any]:
+        """Invoke the best target, failing over until one streams its first chunk."""
+        session_id = kwargs.get('sessionId')
+        session_state = kwargs.get('inlineSessionState') or {}
+        with self._lock:
+            pinned = self._session_targets.get(session_id)
+        if 'returnControlInvocationResults' in session_state and pinned is not None:
+            targets = [pinned]
+        else:
+            targets = self.rank_targets()
+            if pinned is not None and pinned.score(time.monotonic(), self.first_chunk_timeout) != float('inf'):
+                # Stay where the session's history is while that target is healthy
+                targets.remove(pinned)
+                targets.insert(0, pinned)
+
+        last_error = None
+        for target in targets:
+            started = threading.Event()
+            future = self._executor.submit(self._start, target, kwargs, started)
+            if not started.wait(self.first_chunk_timeout) and future.cancel():
+                # Every worker is busy: the router is saturated, which says nothing about the
+                # target, and the other targets would wait for the same workers
+                raise RoutingError(f"No router worker became free within {self.first_chunk_timeout}s; "
+                                   f"raise max_concurrency") from last_error
+            start = time.perf_counter()
+            try:
+                response, stream, first_chunk = future.result(timeout=self.first_chunk_timeout)
+            except FutureTimeoutError:
+                last_error = RoutingError(f"{target.name} produced no chunk within {self.first_chunk_timeout}s")
+                # Let the abandoned stream finish on its own and close it
+                future.add_done_callback(_close_abandoned_stream)
+                self._record_failure(target, last_error)
+                continue
+            except Exception as e:
+                last_error = e
+                self._record_failure(target, e)
+                continue
+
+            self._record_first_chunk(target, time.perf_counter() - start)
+            self._pin_session(session_id, target)
+            completion = stream if first_chunk is _NO_CHUNK else _prepend(first_chunk, stream)
+            return dict(response, completion=self._watch_stream(target, completion), routedTo=target.name)
+
+        raise RoutingError(f"All targets failed, last error: {last_error}") from last_error
+
+    def _watch_stream(self, target: RouteTarget, stream: Iterator) -> Iterator:
+        """Pass a stream through, recording the turn's outcome once it ends, so mid-stream errors count too."""
+        failed = False
+        try:
+            yield from stream
+        except Exception as e:
+            failed = True
+            self._record_failure(target, e)
+            raise
+        finally:
+            # A stream the caller stopped reading still counts as a success of the target
+            if not failed:
+                self._record_success(target)
+
+
+def _prepend(first: Any, rest: Iterator) -> Iterator:
+    yield first
+    yield from rest
+
+
+def _close_abandoned_stream(future) -> None:
+    if future.cancelled() or future.exception() is not None:
+        return
+    response, _, _ = future.result()
+    close = getattr(response['completion'], 'close', None)
+    if close is not None:
+        close()
+
+
+class StubThrottlingException(Exception):
+    """Stands in for botocore's ThrottlingException in StubAgentClient."""
+
+
+class StubAgentClient:
+    """
+    Local stand-in for a bedrock-agent-runtime client, simulating a region's latency and throttling.
+
+    Useful to exercise AgentRouter without AWS credentials.
+    """
+
+    def __init__(self, first_chunk_latency: float = 0.1, throttle_rate: float = 0.0,
+                 chunks: Iterable[str] = ("Hello", " from", " a stub"), jitter: float = 0.0,
+                 fail_after_chunks: Optional[int] = None):
+        self.first_chunk_latency = first_chunk_latency
+        self.throttle_rate = throttle_rate
+        self.chunks = tuple(chunks)
+        self.jitter = jitter
+        # Throttle mid-stream after this many chunks, as Bedrock can
+        self.fail_after_chunks = fail_after_chunks
+        self.calls = 0
+
+    def invoke_inline_agent(self, **kwargs) -> Dict[str, Any]:
+        self.calls += 1
+        if random.random() < self.throttle_rate:
+            raise StubThrottlingException("Rate exceeded")
+        return {'completion': self._stream()}
+
+    def _stream(self) -> Iterator[Dict[str, Any]]:
+        time.sleep(max(0.0, self.first_chunk_latency + random.uniform(-self.jitter, self.jitter)))
+        for index, text in enumerate(self.chunks):
+            if index == self.fail_after_chunks:
+                raise StubThrottlingException("Rate exceeded")
+            yield {'chunk': {'bytes': text.encode('utf-8')}}
+
+
+if __name__ == "__main__":
+    # Simulate three regions: fast but throttling, steady, and slow enough to time out
+    router = AgentRouter([
+        RouteTarget("us-east-1", "us.amazon.nova-pro-v1:0", StubAgentClient(0.05, throttle_rate=0.3)),
+        RouteTarget("us-west-2", "us.amazon.nova-pro-v1:0", StubAgentClient(0.1, jitter=0.02)),
+        RouteTarget("eu-west-1", "eu.amazon.nova-pro-v1:0", StubAgentClient(2.0)),
+    ], first_chunk_timeout=0.5, error_cooldown=0.5, throttle_cooldown=1.0)
+
+    served = {}
+    for turn in range(40):
+        response = router.invoke_inline_agent(sessionId=f"session-{turn}", inputText="hi")
+        served[response['routedTo']] = served.get(response['routedTo'], 0) + 1
+        "".join(chunk['chunk']['bytes'].decode('utf-8') for chunk in response['completion'])
+
+    print("Turns served:", served)
+    for target_stats in router.stats():
+        print(target_stats)
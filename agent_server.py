@@ -0,0 +1,368 @@
+import argparse
+import asyncio
+import json
+import re
+import time
+import uuid
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from agent_router import AgentRouter
+from bedrock_agent_helper import AgentEvent, BedrockAgent, TraceMode
+from function_calls import get_tool_metrics
+from intialize_agent import initialize
+from location_tools import set_client_ip
+from response_cache import CacheMode, ResponseCache
+from session_memory import EventLog
+from turn_profiler import TurnProfiler, add_profiling_arguments, profiler_from_args
+
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+# Bedrock's sessionId format; also keeps the id safe to echo in a response header
+_SESSION_ID_PATTERN = re.compile(r"[0-9a-zA-Z._:-]{1,100}")
+
+# Events a turn may run ahead of a slow client before its worker thread waits
+MAX_QUEUED_EVENTS = 64
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            409: "Conflict", 413: "Payload Too Large", 503: "Service Unavailable"}
+
+# Marks the end of a turn on the queue between the worker thread and the event loop
+_END_OF_TURN = object()
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class AgentSession:
+    """State kept per agent session between requests."""
+    __slots__ = ('agent', 'session_attributes', 'client_ip', 'event_log', 'last_used', 'lock')
+
+    def __init__(self, agent: BedrockAgent, session_attributes: Dict[str, Any], client_ip: Optional[str],
+                 event_log: EventLog):
+        self.agent = agent
+        self.session_attributes = session_attributes
+        self.client_ip = client_ip
+        self.event_log = event_log
+        self.last_used = time.monotonic()
+        # Bedrock only allows one turn at a time per session
+        self.lock = asyncio.Lock()
+
+
+def _json_default(obj):
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8', errors='replace')
+    return str(obj)
+
+
+def encode_event(event: AgentEvent) -> str:
+    """Serialize an AgentEvent as a single line of JSON."""
+    return json.dumps({'type': event.type.value, 'data': event.data, 'cached': event.cached}, default=_json_default)
+
+
+class AgentServer:
+    """
+    Asyncio HTTP server streaming agent turns to many concurrent sessions.
+
+    POST /invoke with a JSON body {"prompt", "session_id", "session_attributes"} streams the
+    turn's AgentEvents back as Server-Sent Events when the request accepts text/event-stream,
+    and as chunked JSON lines otherwise. Sessions keep their BedrockAgent between requests and
+    are evicted after idle_timeout seconds; each keeps its events in an EventLog of at most
+    session_memory_budget bytes. A session's client IP is the peer address, or the first
+    X-Forwarded-For address when trust_forwarded_for is set. All sessions share one bedrock-agent-runtime
+    client, one worker pool, the optional response cache, and the module level tool registry
+    and geolocation cache.
+    """
+
+    def __init__(
+            self,
+            concurrency: int = 32,
+            idle_timeout: float = 15 * 60,
+            max_sessions: int = 10000,
+            model_id: Optional[str] = None,
+            instructions: Optional[str] = None,
+            trace_mode: TraceMode = TraceMode.OFF,
+            region_name: str = "us-west-2",
+            response_cache: Optional[ResponseCache] = None,
+            router: Optional[AgentRouter] = None,
+            profiler: Optional[TurnProfiler] = None,
+            session_memory_budget: int = 4 * 1024 * 1024,
+            trust_forwarded_for: bool = False
+    ):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.model_id = model_id
+        self.instructions = instructions
+        self.trace_mode = trace_mode
+        self.response_cache = response_cache
+        self.profiler = profiler
+        self.session_memory_budget = session_memory_budget
+        # Only behind a proxy that sets X-Forwarded-For can the header be believed
+        self.trust_forwarded_for = trust_forwarded_for
+        # A router stands in for the client and picks a (region, model) target per turn
+        self.client = router if router is not None else \
+            BedrockAgent.create_client(region_name, max_pool_connections=concurrency)
+        # invoke_agent is a blocking generator; turns run on these threads
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="agent-turn")
+        self.sessions: Dict[str, AgentSession] = {}
+
+    def _get_session(self, session_id: str, client_ip: Optional[str]) -> AgentSession:
+        session = self.sessions.get(session_id)
+        if session is None:
+            if len(self.sessions) >= self.max_sessions:
+                self._evict_least_recently_used()
+            event_log = EventLog(max_bytes=self.session_memory_budget)
+            agent, session_attributes = initialize(session_id, self.instructions, self.model_id,
+                                                   client_ip=client_ip, prefetch_geoip=True,
+                                                   trace_mode=self.trace_mode, client=self.client,
+                                                   response_cache=self.response_cache,
+                                                   profiler=self.profiler, event_log=event_log)
+            session = AgentSession(agent, session_attributes, client_ip, event_log)
+            self.sessions[session_id] = session
+        session.last_used = time.monotonic()
+        return session
+
+    def _evict_least_recently_used(self) -> None:
+        idle = [(session.last_used, session_id) for session_id, session in self.sessions.items()
+                if not session.lock.locked()]
+        if not idle:
+            raise HttpError(503, "Too many active sessions")
+        del self.sessions[min(idle)[1]]
+
+    def evict_idle_sessions(self) -> int:
+        """Drop sessions that have not been used for idle_timeout seconds. Returns how many were dropped."""
+        cutoff = time.monotonic() - self.idle_timeout
+        expired = [session_id for session_id, session in self.sessions.items()
+                   if session.last_used < cutoff and not session.lock.locked()]
+        for session_id in expired:
+            del self.sessions[session_id]
+        return len(expired)
+
+    async def _evict_idle_sessions_forever(self) -> None:
+        while True:
+            await asyncio.sleep(min(self.idle_timeout, 60))
+            self.evict_idle_sessions()
+
+    def _run_turn(self, session: AgentSession, prompt: str, loop: asyncio.AbstractEventLoop,
+                  queue: asyncio.Queue, cancelled: list) -> None:
+        """Iterate a turn on a worker thread, handing each event to the event loop."""
+        def put(item):
+            # Blocks while the queue is full, so a slow client slows the turn down
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        set_client_ip(session.client_ip)
+        try:
+            for event in session.agent.invoke_agent(prompt, session.session_attributes):
+                if cancelled:
+                    break
+                put(event)
+        except Exception as e:
+            put(e)
+        finally:
+            put(_END_OF_TURN)
+
+    async def _stream_turn(self, session: AgentSession, prompt: str, writer: asyncio.StreamWriter, sse: bool) -> None:
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=MAX_QUEUED_EVENTS)
+        cancelled = []
+        finished = False
+        turn = loop.run_in_executor(self.executor, self._run_turn, session, prompt, loop, queue, cancelled)
+        try:
+            while True:
+                item = await queue.get()
+                if item is _END_OF_TURN:
+                    finished = True
+                    break
+                if isinstance(item, Exception):
+                    line = json.dumps({'type': 'error', 'data': f"{type(item).__name__}: {item}"})
+                    event_type = 'error'
+                else:
+                    line = encode_event(item)
+                    event_type = item.type.value
+                payload = f"event: {event_type}\ndata: {line}\n\n" if sse else line + "\n"
+                await self._write_chunk(writer, payload.encode('utf-8'))
+        finally:
+            if not finished:
+                # The client went away; stop the turn at its next event, and keep taking events
+                # so the worker is not left waiting on a full queue
+                cancelled.append(True)
+                while await queue.get() is not _END_OF_TURN:
+                    pass
+            await turn
+            session.last_used = time.monotonic()
+
+    @staticmethod
+    async def _write_chunk(writer: asyncio.StreamWriter, data: bytes) -> None:
+        writer.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        await writer.drain()
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], bytes]:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise HttpError(413, "Request headers too large")
+        lines = head.decode('latin-1').split("\r\n")
+        try:
+            method, path, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "Malformed request line")
+
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length') or 0)
+        except ValueError:
+            raise HttpError(400, "Invalid Content-Length")
+        if length < 0:
+            raise HttpError(400, "Invalid Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HttpError(413, "Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method, path.split("?", 1)[0], headers, body
+
+    @staticmethod
+    async def _send_response(writer: asyncio.StreamWriter, status: int, body: Dict[str, Any]) -> None:
+        data = json.dumps(body).encode('utf-8')
+        writer.write(
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: close\r\n\r\n".encode('latin-1') + data
+        )
+        await writer.drain()
+
+    async def _invoke(self, headers: Dict[str, str], body: bytes, peer_ip: Optional[str], writer: asyncio.StreamWriter) -> None:
+        try:
+            request = json.loads(body or b"{}")
+        except json.JSONDecodeError:
+            raise HttpError(400, "Body must be JSON")
+        prompt = request.get('prompt')
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise HttpError(400, "Missing 'prompt'")
+        session_id = str(request.get('session_id') or uuid.uuid4())
+        if not _SESSION_ID_PATTERN.fullmatch(session_id):
+            raise HttpError(400, "'session_id' must be 1 to 100 characters of [0-9a-zA-Z._:-]")
+
+        forwarded_for = headers.get('x-forwarded-for') if self.trust_forwarded_for else None
+        client_ip = forwarded_for.split(",")[0].strip() if forwarded_for else peer_ip
+        session = self._get_session(session_id, client_ip)
+        if session.lock.locked():
+            raise HttpError(409, f"Session {session_id} already has a turn in progress")
+
+        async with session.lock:
+            session.session_attributes.update(request.get('session_attributes') or {})
+            sse = 'text/event-stream' in headers.get('accept', '')
+            writer.write(
+                f"HTTP/1.1 200 OK\r\n"
+                f"Content-Type: {'text/event-stream' if sse else 'application/x-ndjson'}\r\n"
+                f"Cache-Control: no-cache\r\n"
+                f"X-Session-Id: {session_id}\r\n"
+                f"Transfer-Encoding: chunked\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1')
+            )
+            await self._stream_turn(session, prompt, writer, sse)
+            await self._write_chunk(writer, b"")
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peer = writer.get_extra_info('peername')
+        peer_ip = peer[0] if peer else None
+        try:
+            method, path, headers, body = await self._read_request(reader)
+            if path == "/health":
+                await self._send_response(writer, 200, {
+                    'status': 'ok',
+                    'sessions': len(self.sessions),
+                    'session_memory_bytes': sum(session.event_log.total_bytes for session in self.sessions.values()),
+                    'tools': get_tool_metrics(),
+                })
+            elif path != "/invoke":
+                raise HttpError(404, f"No route for {path}")
+            elif method != "POST":
+                raise HttpError(405, "Use POST")
+            else:
+                await self._invoke(headers, body, peer_ip, writer)
+        except HttpError as e:
+            await self._send_response(writer, e.status, {'error': str(e)})
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "0.0.0.0", port: int = 8080) -> None:
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_BYTES)
+        evictor = asyncio.create_task(self._evict_idle_sessions_forever())
+        print(f"Serving agent on http://{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            evictor.cancel()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the agent over HTTP, streaming events per turn.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--concurrency", type=int, default=32, help="number of turns running at once")
+    parser.add_argument("--idle-timeout", type=float, default=15 * 60, help="seconds before an idle session is evicted")
+    parser.add_argument("--max-sessions", type=int, default=10000)
+    parser.add_argument("--model-id", default=None)
+    parser.add_argument("--trace-mode", default=TraceMode.OFF.value, choices=[mode.value for mode in TraceMode])
+    parser.add_argument("--region", default="us-west-2")
+    parser.add_argument("--response-cache-size", type=int, default=0,
+                        help="number of first turns to cache and replay (default: no response cache)")
+    parser.add_argument("--response-cache-ttl", type=float, default=15 * 60, help="seconds a cached turn stays valid")
+    parser.add_argument("--response-cache-mode", default=CacheMode.EVENTS.value, choices=[mode.value for mode in CacheMode])
+    parser.add_argument("--route", action="append", default=[], metavar="REGION=MODEL_ID",
+                        help="route turns over these (region, model) targets instead of --region/--model-id; repeatable")
+    parser.add_argument("--first-chunk-timeout", type=float, default=10.0,
+                        help="with --route, seconds to wait for a target's first chunk before failing over")
+    parser.add_argument("--trust-forwarded-for", action="store_true",
+                        help="take the client IP from X-Forwarded-For; only behind a proxy that sets it")
+    parser.add_argument("--session-memory-budget", type=int, default=4 * 1024 * 1024,
+                        help="bytes of event payloads kept per session before old traces are dropped")
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+
+    router = None
+    if args.route:
+        try:
+            pool = [tuple(route.split("=", 1)) for route in args.route]
+            router = AgentRouter.from_pool(pool, max_concurrency=args.concurrency,
+                                           first_chunk_timeout=args.first_chunk_timeout)
+        except ValueError:
+            parser.error("--route must look like us-west-2=us.amazon.nova-pro-v1:0")
+
+    response_cache = None
+    if args.response_cache_size > 0:
+        response_cache = ResponseCache(max_entries=args.response_cache_size,
+                                       ttl=args.response_cache_ttl,
+                                       mode=CacheMode(args.response_cache_mode))
+
+    agent_server = AgentServer(concurrency=args.concurrency,
+                               idle_timeout=args.idle_timeout,
+                               max_sessions=args.max_sessions,
+                               model_id=args.model_id,
+                               trace_mode=TraceMode(args.trace_mode),
+                               region_name=args.region,
+                               response_cache=response_cache,
+                               router=router,
+                               profiler=profiler_from_args(args),
+                               session_memory_budget=args.session_memory_budget,
+                               trust_forwarded_for=args.trust_forwarded_for)
+    try:
+        asyncio.run(agent_server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -1,28 +1,50 @@
 import folium
 import json
+import os
 import re
 import streamlit as st
 import uuid
 from enum import Enum
+from itertools import islice
 from streamlit_folium import folium_static
 
 from bedrock_agent_helper import EventType, BedrockAgent
 from intialize_agent import initialize
+from session_memory import EventLog
 from session_state_persistence import initialize_persistent_state
 
 # Define constants for session state keys
 INSTRUCTIONS_KEY = "instructions"
 MODEL_ID_KEY = "model_id"
 AGENT_SESSION_ID_KEY = "agent_session_id"
+EVENT_LOG_KEY = "event_log"
+
+# Old trace payloads of a session are dropped once its events go over this many bytes
+SESSION_EVENTS_MEMORY_BUDGET = int(os.getenv("SESSION_EVENTS_MEMORY_BUDGET", str(4 * 1024 * 1024)))
 
 st.set_page_config(layout="wide")
 state_manager = initialize_persistent_state()
 
+def get_forwarded_client_ip():
+    """Return the user's IP when the UI runs behind a proxy that forwards it, else None."""
+    forwarded_for = st.context.headers.get("X-Forwarded-For")
+    if forwarded_for:
+        return forwarded_for.split(",")[0].strip()
+    return st.context.headers.get("X-Real-Ip")
+
 ##read from state
 agent_session_id = st.session_state.get(AGENT_SESSION_ID_KEY, str(uuid.uuid4()))
+client_ip = get_forwarded_client_ip()
+event_log = st.session_state.get(EVENT_LOG_KEY)
+if event_log is None:
+    event_log = EventLog(max_bytes=SESSION_EVENTS_MEMORY_BUDGET)
+    st.session_state[EVENT_LOG_KEY] = event_log
 agent, session_attributes = initialize(agent_session_id,
                                      st.session_state.get(INSTRUCTIONS_KEY, None),
-                                     st.session_state.get(MODEL_ID_KEY, None))
+                                     st.session_state.get(MODEL_ID_KEY, None),
+                                     client_ip=client_ip,
+                                     prefetch_geoip=True,
+                                     event_log=event_log)
 st.session_state[AGENT_SESSION_ID_KEY] = agent_session_id
 
 
@@ -115,13 +137,13 @@ with chat_tab:
             human_placeholder.container(border=True).chat_message(name="human").write(prompt)
             status_bar = st.status(f"Invoking agent[{agent.model_id}]...", expanded=True)
             response_container = st.empty()
-            # Stream the response
-            responses = []
+            # Stream the response; the agent keeps the session's events in event_log
+            turn_events = 0
             for event in generate_response_from_agent(prompt, final_text_placeholder, map_placeholder):
-                responses.append(event)
+                turn_events += 1
                 response_container.container().empty()
                 with response_container.container(border=True, height=600):
-                    for response in reversed(responses):
+                    for response in islice(reversed(event_log), turn_events):
                         st.write(response)
             status_bar.update(label="Final Answer!", state="complete", expanded=False)
 
@@ -148,7 +170,9 @@ with config_tab:
             st.session_state[MODEL_ID_KEY] = model_id
             agent, session_attributes = initialize(agent_session_id,
                                                 st.session_state.get(INSTRUCTIONS_KEY, None),
-                                                st.session_state.get(MODEL_ID_KEY, None))
+                                                st.session_state.get(MODEL_ID_KEY, None),
+                                                client_ip=client_ip,
+                                                event_log=event_log)
             # Save state after important changes
             state_manager.save_current_state([INSTRUCTIONS_KEY, MODEL_ID_KEY])
             st.success("Configuration updated successfully!")
\ No newline at end of file
@@ -0,0 +1,215 @@
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, Optional, Set
+
+from bedrock_agent_helper import BedrockAgent, EventType, TraceMode
+from intialize_agent import initialize
+from turn_profiler import TurnProfiler, add_profiling_arguments, profiler_from_args
+
+
+def read_prompts(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Read prompts from a JSONL file.
+
+    Each line is an object with a 'prompt' and optionally an 'id' and 'session_attributes'.
+    Lines without an id are identified by their line number, so resuming works as long as
+    the input file is not reordered.
+
+    Args:
+        path: path of the input JSONL file
+    """
+    with open(path, 'r') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if 'prompt' not in record:
+                raise ValueError(f"{path}:{line_number}: missing 'prompt'")
+            record.setdefault('id', str(line_number))
+            yield record
+
+
+def read_completed_ids(path: str, retry_errors: bool = False) -> Set[str]:
+    """
+    Return the ids already recorded in an output file, so an interrupted run can resume.
+
+    Args:
+        path: path of the output JSONL file
+        retry_errors: if True, prompts that failed are not considered completed
+    """
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by the interruption; the prompt is simply run again
+                continue
+            if not isinstance(result, dict) or 'id' not in result:
+                # Not a result this runner wrote
+                continue
+            if retry_errors and result.get('status') != 'ok':
+                continue
+            completed.add(str(result['id']))
+    return completed
+
+
+def _ends_with_newline(path: str) -> bool:
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def run_prompt(record: Dict[str, Any], instructions: Optional[str], model_id: Optional[str], client: Any,
+               profiler: Optional[TurnProfiler] = None) -> Dict[str, Any]:
+    """Run one prompt through its own agent session and return the result with its timings."""
+    session_id = str(uuid.uuid4())
+    result = {
+        'id': record['id'],
+        'session_id': session_id,
+        'prompt': record['prompt'],
+        'started_at': datetime.now(timezone.utc).isoformat(),
+    }
+    errors = []
+    completion = None
+    tool_calls = 0
+    first_chunk_ms = None
+
+    start = time.perf_counter()
+    try:
+        # Inside the try, so a prompt that cannot even start fails alone instead of the batch
+        agent, session_attributes = initialize(session_id, instructions, model_id,
+                                               trace_mode=TraceMode.OFF, client=client, profiler=profiler)
+        session_attributes.update(record.get('session_attributes') or {})
+        for event in agent.invoke_agent(record['prompt'], session_attributes):
+            if event.type == EventType.CHUNK and first_chunk_ms is None:
+                first_chunk_ms = (time.perf_counter() - start) * 1000
+            elif event.type == EventType.FUNCTION_RESULT:
+                tool_calls += 1
+            elif event.type == EventType.ERROR:
+                errors.append(str(event.data))
+            elif event.type == EventType.COMPLETION:
+                completion = event.data
+    except Exception as e:
+        errors.append(f"{type(e).__name__}: {e}")
+
+    result.update({
+        'finished_at': datetime.now(timezone.utc).isoformat(),
+        'status': 'ok' if completion is not None and not errors else 'error',
+        'completion': completion,
+        'errors': errors,
+        'timings': {
+            'total_ms': round((time.perf_counter() - start) * 1000, 1),
+            'first_chunk_ms': round(first_chunk_ms, 1) if first_chunk_ms is not None else None,
+            'tool_calls': tool_calls,
+        },
+    })
+    return result
+
+
+def run_batch(
+        input_path: str,
+        output_path: str,
+        concurrency: int = 4,
+        instructions: Optional[str] = None,
+        model_id: Optional[str] = None,
+        resume: bool = False,
+        retry_errors: bool = False,
+        region_name: str = "us-west-2",
+        profiler: Optional[TurnProfiler] = None
+) -> Dict[str, int]:
+    """
+    Run every prompt of a JSONL file through the agent, several at a time.
+
+    Results are appended to the output JSONL in completion order as soon as each prompt
+    finishes, so an interrupted run keeps everything finished so far.
+
+    Args:
+        input_path: JSONL file of prompts, see read_prompts
+        output_path: JSONL file the results are written to
+        concurrency: number of prompts in flight at once
+        instructions: agent instructions, defaults to the ones used by initialize
+        model_id: model id, defaults to the one used by initialize
+        resume: skip prompts already recorded in the output file instead of overwriting it
+        retry_errors: when resuming, run prompts that failed previously again
+        region_name: AWS region of the shared bedrock-agent-runtime client
+        profiler: profiles selected turns, see turn_profiler.TurnProfiler
+    Returns:
+        dict: counts of prompts that succeeded, failed and were skipped
+    """
+    completed = read_completed_ids(output_path, retry_errors) if resume else set()
+    client = BedrockAgent.create_client(region_name, max_pool_connections=concurrency)
+    counts = {'ok': 0, 'error': 0, 'skipped': 0}
+
+    with open(output_path, 'a' if resume else 'w') as output, \
+            ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as executor:
+        if resume and output.tell() > 0 and not _ends_with_newline(output_path):
+            # Terminate a line cut short by the interruption before appending to it
+            output.write("\n")
+        in_flight = set()
+
+        def drain(timeout=None):
+            """Write the results that finished within timeout seconds, waiting for at least one if None."""
+            nonlocal in_flight
+            done, in_flight = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            # done is a set; write its results in the order they finished
+            for result in sorted((future.result() for future in done), key=lambda result: result['finished_at']):
+                counts[result['status']] += 1
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+                print(f"[{result['status']}] {result['id']} in {result['timings']['total_ms']:.0f} ms", file=sys.stderr)
+
+        for record in read_prompts(input_path):
+            if str(record['id']) in completed:
+                counts['skipped'] += 1
+                continue
+            # Keep reading lazily; only a bounded window of prompts is ever in memory
+            if len(in_flight) >= concurrency * 2:
+                drain()
+            in_flight.add(executor.submit(run_prompt, record, instructions, model_id, client, profiler))
+            # Write whatever has finished meanwhile, without waiting
+            drain(timeout=0)
+
+        while in_flight:
+            drain()
+
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a JSONL file of prompts through the agent.")
+    parser.add_argument("input", help="JSONL file with one {'id', 'prompt', 'session_attributes'} object per line")
+    parser.add_argument("output", help="JSONL file results are written to, in completion order")
+    parser.add_argument("--concurrency", type=int, default=4, help="number of prompts in flight at once")
+    parser.add_argument("--model-id", default=None)
+    parser.add_argument("--instructions-file", default=None, help="file with the agent instructions")
+    parser.add_argument("--region", default="us-west-2")
+    parser.add_argument("--resume", action="store_true", help="skip prompts already in the output file")
+    parser.add_argument("--retry-errors", action="store_true", help="with --resume, run failed prompts again")
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+
+    instructions = None
+    if args.instructions_file:
+        with open(args.instructions_file, 'r') as f:
+            instructions = f.read()
+
+    counts = run_batch(args.input, args.output,
+                       concurrency=args.concurrency,
+                       instructions=instructions,
+                       model_id=args.model_id,
+                       resume=args.resume,
+                       retry_errors=args.retry_errors,
+                       region_name=args.region,
+                       profiler=profiler_from_args(args))
+    print(f"Done: {counts['ok']} ok, {counts['error']} failed, {counts['skipped']} skipped", file=sys.stderr)
@@ -1,12 +1,10 @@
-import boto3
 import json
-import asyncio
-from typing import Dict, Any, Tuple, Optional, Generator, Union, AsyncGenerator
-from dataclasses import dataclass
+from collections.abc import Mapping
+from typing import Dict, Any, Tuple, Optional, Generator, Union
+from dataclasses import dataclass, replace
 from enum import Enum
-from types import TracebackType
-from typing_extensions import Self  # For Python < 3.11
-from function_calls import parse_function_parameters, invoke_tool
+from function_calls import extract_invocation_inputs, submit_tool, ToolCallValidationError
+from response_cache import ResponseCache
 
 # Define event types
 class EventType(Enum):
@@ -17,46 +15,170 @@ class EventType(Enum):
     ERROR = "error"
     COMPLETION = "completion"
 
-@dataclass
+class TraceMode(Enum):
+    OFF = "off"          # traces are not requested from Bedrock
+    SUMMARY = "summary"  # only a small summary of the interesting traces is yielded
+    FULL = "full"        # every trace is yielded as a LazyTrace
+
+@dataclass(slots=True)
 class AgentEvent:
     type: EventType
     data: Any
+    cached: bool = False  # True when replayed from a ResponseCache
+
+class LazyTrace(Mapping):
+    """
+    Read-only view over a raw trace part from the response stream.
+
+    Nothing is extracted until it is accessed. As a mapping it exposes the body of the
+    trace (e.g. the orchestrationTrace), whatever kind of trace it is.
+    """
+    __slots__ = ('_part',)
+
+    # Orchestration trace fields that carry no summary-worthy information on their own
+    _BULKY_FIELDS = frozenset(('modelInvocationInput', 'modelInvocationOutput'))
+
+    def __init__(self, part: Dict[str, Any]):
+        self._part = part
+
+    @property
+    def raw(self) -> Dict[str, Any]:
+        """The trace part exactly as received from Bedrock."""
+        return self._part
+
+    @property
+    def kind(self) -> Optional[str]:
+        """The kind of trace, e.g. 'orchestrationTrace', 'guardrailTrace' or 'preProcessingTrace'."""
+        return next(iter(self._part.get('trace') or {}), None)
+
+    @property
+    def body(self) -> Dict[str, Any]:
+        trace = self._part.get('trace') or {}
+        return next(iter(trace.values()), {})
+
+    def __getitem__(self, key):
+        return self.body[key]
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def __len__(self):
+        return len(self.body)
+
+    def __repr__(self):
+        return f"LazyTrace(kind={self.kind!r})"
+
+    @property
+    def summary(self) -> Optional[Dict[str, Any]]:
+        """A small summary of the trace, or None if it only carries model input/output."""
+        kind = self.kind
+        body = self.body
+        summary = {}
+        if 'rationale' in body:
+            summary['rationale'] = body['rationale'].get('text')
+        if 'invocationInput' in body:
+            invocation_input = body['invocationInput']
+            summary['invocation'] = invocation_input.get('invocationType')
+            action_group_input = invocation_input.get('actionGroupInvocationInput')
+            if action_group_input:
+                summary['function'] = action_group_input.get('function') or action_group_input.get('apiPath')
+        if 'observation' in body:
+            summary['observation'] = body['observation'].get('type')
+        if 'failureReason' in body:
+            summary['failure'] = body['failureReason']
+        if kind == 'guardrailTrace':
+            summary['action'] = body.get('action')
+        if not summary and (not body or self._BULKY_FIELDS.issuperset(body)):
+            return None
+        summary['kind'] = kind
+        return summary
 
 class BedrockAgent:
+    __slots__ = ('session_id', 'model_id', 'action_groups', 'instructions', 'trace_mode', 'response_cache',
+                 'cache_context', 'event_log', 'profiler', 'invocation_id', 'turn_count', 'bedrock_rt_client')
+
     def __init__(
             self,
             session_id: str,
             model_id: str,
             action_groups: list,
             instructions: str,
-            region_name: str = "us-west-2"
+            region_name: str = "us-west-2",
+            trace_mode: Union[TraceMode, str] = TraceMode.FULL,
+            client: Any = None,
+            response_cache: Optional[ResponseCache] = None,
+            cache_context: Any = None,
+            event_log: Any = None,
+            profiler: Any = None
     ):
-        """Initialize the BedrockAgent with required parameters."""
+        """
+        Initialize the BedrockAgent with required parameters.
+
+        response_cache is opt-in and may be shared between agents. cache_context is added to
+        the cache key for whatever else the answer depends on, e.g. the client IP the user's
+        location is derived from. If event_log is given (e.g. a session_memory.EventLog with a
+        memory budget), every event of every turn is appended to it. If profiler is given (a
+        turn_profiler.TurnProfiler), it decides which turns to profile.
+        """
         self.session_id = session_id
         self.model_id = model_id
         self.action_groups = action_groups
         self.instructions = instructions
+        self.trace_mode = TraceMode(trace_mode)
+        self.response_cache = response_cache
+        self.cache_context = cache_context
+        self.event_log = event_log
+        self.profiler = profiler
         self.invocation_id = None
+        self.turn_count = 0
+
+        # Initialize boto3 client, unless one is shared with other agents
+        self.bedrock_rt_client = client if client is not None else self.create_client(region_name)
+
+    @staticmethod
+    def create_client(region_name: str = "us-west-2", max_pool_connections: Optional[int] = None):
+        """
+        Create a bedrock-agent-runtime client. Clients are thread safe, so one client can be
+        shared by many agents; size max_pool_connections to the number of concurrent turns.
+        """
+        # boto3 takes a few hundred milliseconds to import; only pay for it when a client is needed
+        import boto3
 
-        # Initialize boto3 client
         session = boto3.Session()
-        self.bedrock_rt_client = session.client(
+        config = None
+        if max_pool_connections:
+            from botocore.config import Config
+            config = Config(max_pool_connections=max_pool_connections)
+        return session.client(
             service_name="bedrock-agent-runtime",
-            region_name=region_name
+            region_name=region_name,
+            config=config
         )
 
-    def _process_response_chunk(self, chunk: Dict) -> AgentEvent:
-        """Process a single chunk from the response stream and convert it to an AgentEvent."""
+    def _process_response_chunk(self, chunk: Dict) -> Optional[AgentEvent]:
+        """
+        Process a single chunk from the response stream and convert it to an AgentEvent.
+        Returns None for traces that the trace mode filters out.
+        """
         if 'chunk' in chunk:
             return AgentEvent(
                 type=EventType.CHUNK,
                 data=chunk['chunk']['bytes'].decode('utf-8')
             )
         elif "trace" in chunk:
-            return AgentEvent(
-                type=EventType.TRACE,
-                data=chunk['trace']['trace']['orchestrationTrace']
-            )
+            if self.trace_mode is TraceMode.FULL:
+                return AgentEvent(
+                    type=EventType.TRACE,
+                    data=LazyTrace(chunk['trace'])
+                )
+            if self.trace_mode is TraceMode.SUMMARY:
+                summary = LazyTrace(chunk['trace']).summary
+                if summary is not None:
+                    return AgentEvent(
+                        type=EventType.TRACE,
+                        data=summary
+                    )
+            return None
         elif 'returnControl' in chunk:
             return AgentEvent(
                 type=EventType.FUNCTION_CALL,
@@ -68,22 +190,39 @@ class BedrockAgent:
                 data=f"Unidentified chunk: {chunk}"
             )
 
-    def _prepare_session_state(self, session_attributes: Dict[str, Any], function_result: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    def _prepare_session_state(self, session_attributes: Dict[str, Any], function_result: Optional[Union[Dict[str, Any], list]] = None) -> Dict[str, Any]:
         """Prepare the session state dictionary."""
         session_state = {
             'promptSessionAttributes': session_attributes,
         }
 
         if function_result and self.invocation_id:
+            function_results = function_result if isinstance(function_result, list) else [function_result]
             session_state.update({
                 'invocationId': self.invocation_id,
-                'returnControlInvocationResults': [{
-                    'functionResult': function_result
-                }]
+                'returnControlInvocationResults': [
+                    {'functionResult': result} for result in function_results
+                ]
             })
 
         return session_state
 
+    @staticmethod
+    def _build_function_result(function_to_call: Dict[str, Any], body: Any, response_state: Optional[str] = None) -> Dict[str, Any]:
+        """Wrap a tool's output in the functionResult format expected by Bedrock."""
+        function_result = {
+            'actionGroup': function_to_call['actionGroup'],
+            'function': function_to_call['function'],
+            'responseBody': {
+                'TEXT': {
+                    'body': json.dumps(body, indent=2)
+                }
+            }
+        }
+        if response_state:
+            function_result['responseState'] = response_state
+        return function_result
+
     @classmethod
     def get_available_models(self):
         return ("us.amazon.nova-pro-v1:0", "us.anthropic.claude-3-5-sonnet-20240620-v1:0")
@@ -92,33 +231,107 @@ class BedrockAgent:
             self,
             input_text: str,
             session_attributes: Dict[str, Any],
-            function_result: Optional[Dict[str, Any]] = None
+            function_result: Optional[Union[Dict[str, Any], list]] = None
     ) -> Generator[AgentEvent, None, None]:
         """Synchronous version of invoke_agent."""
+        events = self._invoke_turn(input_text, session_attributes, function_result)
+        if not function_result:
+            self.turn_count += 1
+            if self.profiler is not None:
+                events = self.profiler.profile_turn(events, self.session_id, self.turn_count)
+
+        if self.event_log is not None:
+            for event in events:
+                self.event_log.append(event)
+                yield event
+        else:
+            yield from events
+
+    def _invoke_turn(
+            self,
+            input_text: str,
+            session_attributes: Dict[str, Any],
+            function_result: Optional[Union[Dict[str, Any], list]] = None
+    ) -> Generator[AgentEvent, None, None]:
+        """Run a turn, through the response cache if there is one."""
+        if function_result:
+            # Continuation of a turn that returned control
+            yield from self._invoke_agent(input_text, session_attributes, function_result)
+            return
+
+        cache = self.response_cache
+        # Both checks: the cache forgets sessions beyond its max_sessions, this agent forgets
+        # turns it was not created for
+        first_turn = cache is not None and cache.start_turn(self.session_id) and self.turn_count == 1
+        if not first_turn:
+            # Tell the model about a first turn that was answered from the cache
+            history = cache.replayed_history(self.session_id) if cache is not None else None
+            yield from self._invoke_agent(input_text, session_attributes, conversation_history=history)
+            return
+
+        key = cache.make_key(self._cache_model_id(), self.instructions, input_text, session_attributes,
+                             self.cache_context, self.trace_mode.value)
+        cached_events = cache.get(key)
+        if cached_events is not None:
+            for event in cached_events:
+                yield replace(event, cached=True)
+            cache.record_replay(self.session_id, input_text, cached_events[-1].data)
+            return
+
+        events = []
+        for event in self._invoke_agent(input_text, session_attributes):
+            events.append(event)
+            yield event
+
+        # Only complete, error free turns are worth replaying
+        if events and events[-1].type == EventType.COMPLETION and \
+                not any(event.type == EventType.ERROR for event in events):
+            cache.put(key, events)
+
+    def _cache_model_id(self) -> str:
+        """The model(s) a turn may be answered by, for the response cache key."""
+        # A router (agent_router.AgentRouter) picks the model per turn, whatever self.model_id says
+        model_ids = getattr(self.bedrock_rt_client, 'model_ids', None)
+        return ",".join(model_ids) if model_ids else self.model_id
+
+    def _invoke_agent(
+            self,
+            input_text: str,
+            session_attributes: Dict[str, Any],
+            function_result: Optional[Union[Dict[str, Any], list]] = None,
+            conversation_history: Optional[list] = None
+    ) -> Generator[AgentEvent, None, None]:
         session_state = self._prepare_session_state(session_attributes, function_result)
+        if conversation_history:
+            session_state['conversationHistory'] = {'messages': conversation_history}
 
         if function_result:
-            yield AgentEvent(
-                type=EventType.FUNCTION_RESULT,
-                data=function_result
-            )
+            for result in (function_result if isinstance(function_result, list) else [function_result]):
+                yield AgentEvent(
+                    type=EventType.FUNCTION_RESULT,
+                    data=result
+                )
 
         response = self.bedrock_rt_client.invoke_inline_agent(
             instruction=self.instructions,
             foundationModel=self.model_id,
             sessionId=self.session_id,
             endSession=False,
-            enableTrace=True,
+            enableTrace=self.trace_mode is not TraceMode.OFF,
             inputText=input_text,
             inlineSessionState=session_state,
             actionGroups=self.action_groups
         )
+        if conversation_history:
+            self.response_cache.forget_replayed_history(self.session_id)
 
         output = ""
         function_call = None
 
         for chunk in response['completion']:
             event = self._process_response_chunk(chunk)
+            if event is None:
+                continue
             yield event
 
             if event.type == EventType.CHUNK:
@@ -127,30 +340,47 @@ class BedrockAgent:
                 function_call = event.data
 
         if function_call:
-            function_to_call = parse_function_parameters(function_call)
-            self.invocation_id = function_to_call.get('invocationId')
+            invocations = extract_invocation_inputs(function_call)
+            self.invocation_id = function_call.get('invocationId')
 
-            data, error = invoke_tool(function_to_call)
-
-            if error:
+            api_invocations = [invocation for invocation in invocations if invocation.invocation_type != 'function']
+            if api_invocations:
                 yield AgentEvent(
                     type=EventType.ERROR,
-                    data=error
+                    data=f"Error API invocations are not supported: {api_invocations[0].http_method} {api_invocations[0].api_path}"
                 )
                 return
 
-            function_result = {
-                'actionGroup': function_to_call['actionGroup'],
-                'function': function_to_call['function'],
-                'responseBody': {
-                    'TEXT': {
-                        'body': json.dumps(data, indent=2)
-                    }
-                }
-            }
+            # Start every requested tool before waiting on any, so they run in parallel
+            function_calls = [invocation.to_function_call() for invocation in invocations]
+            pending = [(function_to_call, submit_tool(function_to_call)) for function_to_call in function_calls]
+
+            function_results = []
+            for function_to_call, future in pending:
+                data, error = future.result()
+
+                if isinstance(error, ToolCallValidationError):
+                    # Let the model fix its own call instead of failing the turn
+                    function_results.append(
+                        self._build_function_result(function_to_call, error.to_dict(), 'REPROMPT'))
+                elif error:
+                    yield AgentEvent(
+                        type=EventType.ERROR,
+                        data=error
+                    )
+                    return
+                else:
+                    function_results.append(self._build_function_result(function_to_call, data))
+
+            if not function_results:
+                yield AgentEvent(
+                    type=EventType.ERROR,
+                    data=f"Error no function invocation found in: {function_call}"
+                )
+                return
 
             # Recursively call invoke_agent with the function results
-            for event in self.invoke_agent(" ", session_attributes, function_result):
+            for event in self._invoke_agent(" ", session_attributes, function_results):
                 yield event
         else:
             yield AgentEvent(
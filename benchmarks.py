@@ -0,0 +1,174 @@
+import argparse
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import timeit
+
+from function_calls import extract_invocation_inputs, parse_function_parameters
+
+
+def _parse_function_parameters_recursive(data):
+    """The original recursive returnControl parser, kept as a baseline for comparison."""
+    function_to_call = {}
+    function_to_call['invocationId'] = data['invocationId']
+
+    def recursive_extract(obj):
+        if isinstance(obj, dict):
+            if 'functionInvocationInput' in obj:
+                func_input = obj['functionInvocationInput']
+                function_to_call['actionGroup'] = func_input.get('actionGroup')
+                function_to_call['function'] = func_input.get('function')
+                function_to_call['agentId'] = func_input.get('agentId')
+                function_to_call['parameters'] = {}
+                if 'parameters' in func_input:
+                    for param in func_input['parameters']:
+                        if all(key in param for key in ['name', 'value']):
+                            function_to_call['parameters'][param['name']] = param['value']
+
+            for value in obj.values():
+                recursive_extract(value)
+
+        elif isinstance(obj, list):
+            for item in obj:
+                recursive_extract(item)
+
+    recursive_extract(data)
+    return function_to_call
+
+
+def make_return_control_payload(trace_entries: int = 200, invocations: int = 1) -> dict:
+    """Build a returnControl payload padded with trace-like nested data."""
+    trace = [{
+        'orchestrationTrace': {
+            'modelInvocationInput': {
+                'text': 'x' * 2000,
+                'inferenceConfiguration': {'maximumLength': 2048, 'stopSequences': ['</answer>'] * 4},
+            },
+            'rationale': {'text': 'reasoning ' * 50, 'traceId': f'trace-{i}'},
+            'observation': {'type': 'ACTION_GROUP', 'tokens': list(range(50))},
+        }
+    } for i in range(trace_entries)]
+
+    return {
+        'invocationId': 'cd6f2da5-49e8-4660-a21f-cbeb3bac9f76',
+        'invocationInputs': [{
+            'functionInvocationInput': {
+                'actionGroup': 'LocationToolsActionGroup',
+                'actionInvocationType': 'RESULT',
+                'agentId': 'INLINE_AGENT',
+                'function': 'search_near',
+                'parameters': [
+                    {'name': 'what', 'type': 'string', 'value': 'coffee'},
+                    {'name': 'll', 'type': 'string', 'value': '40.74,-74.0'},
+                    {'name': 'radius', 'type': 'integer', 'value': '1600'},
+                ],
+                'trace': trace,
+            }
+        } for _ in range(invocations)],
+    }
+
+
+def bench_return_control_parsing(number: int = 200) -> None:
+    for trace_entries in (0, 50, 500):
+        payload = make_return_control_payload(trace_entries)
+        assert parse_function_parameters(payload) == _parse_function_parameters_recursive(payload)
+
+        recursive = timeit.timeit(lambda: _parse_function_parameters_recursive(payload), number=number)
+        direct = timeit.timeit(lambda: extract_invocation_inputs(payload), number=number)
+        print(f"returnControl parsing, {trace_entries:>4} trace entries: "
+              f"recursive {recursive / number * 1e6:10.1f} us, "
+              f"direct {direct / number * 1e6:8.1f} us, "
+              f"speedup {recursive / direct:8.1f}x")
+
+
+def _import_times(module: str) -> dict:
+    """Import a module in a fresh interpreter and return the cumulative import time of each module, in us."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def bench_import_time(runs: int = 5, modules=('intialize_agent', 'bedrock_agent_helper', 'function_calls')) -> None:
+    for module in modules:
+        try:
+            samples = sorted(_import_times(module)[module] for _ in range(runs))
+        except RuntimeError as e:
+            print(f"import {module}: failed ({e})")
+            continue
+        print(f"import {module:<22} median {samples[len(samples) // 2] / 1000:7.1f} ms, "
+              f"min {samples[0] / 1000:7.1f} ms")
+
+    slowest = sorted(_import_times(modules[0]).items(), key=lambda item: item[1], reverse=True)[1:6]
+    print("slowest imports below " + modules[0] + ": " +
+          ", ".join(f"{name} {cumulative / 1000:.1f} ms" for name, cumulative in slowest))
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def _retain_session_events(budget, sessions, turns, traces_per_turn, results) -> None:
+    from bedrock_agent_helper import AgentEvent, EventType, LazyTrace
+    from session_memory import EventLog
+
+    logs = []
+    for session in range(sessions):
+        log = [] if budget is None else EventLog(max_bytes=budget)
+        for turn in range(turns):
+            for i in range(traces_per_turn):
+                # Every trace gets its own payload, as when decoded from the stream
+                text = f"{session}/{turn}/{i} " + "model input " * 700
+                log.append(AgentEvent(type=EventType.TRACE, data=LazyTrace(
+                    {'trace': {'orchestrationTrace': {'modelInvocationInput': {'text': text}}}})))
+            log.append(AgentEvent(type=EventType.COMPLETION, data="answer " * 100))
+        logs.append(log)
+    results.put((peak_rss_mb(), sum(len(log) for log in logs)))
+
+
+def bench_session_memory(sessions: int = 200, turns: int = 10, traces_per_turn: int = 8) -> None:
+    # Each scenario runs in a fresh process, since peak RSS only ever grows
+    context = multiprocessing.get_context("fork" if sys.platform != "win32" else "spawn")
+    for label, budget in (("unbounded list", None), ("EventLog 256 KB", 256 * 1024), ("EventLog 64 KB", 64 * 1024)):
+        results = context.Queue()
+        process = context.Process(target=_retain_session_events,
+                                  args=(budget, sessions, turns, traces_per_turn, results))
+        process.start()
+        peak, events = results.get()
+        process.join()
+        print(f"{sessions} sessions x {turns} turns, {label:<16}: peak RSS {peak:7.1f} MB, {events} events kept")
+
+
+BENCHMARKS = {
+    'parsing': bench_return_control_parsing,
+    'imports': bench_import_time,
+    'memory': bench_session_memory,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the agent hot paths.")
+    parser.add_argument("names", nargs="*", help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name]()
+        print(f"[{name}] peak RSS of the benchmark process: {peak_rss_mb():.1f} MB")
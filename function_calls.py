@@ -1,25 +1,260 @@
+import hashlib
 import inspect
+import json
+import os
+import types
+import typing
+from dataclasses import dataclass
+from concurrent.futures import Future
 from functools import wraps
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable
+
+from tool_executor import ToolExecutor
 
 # Store decorated functions
 _decorated_functions = []
 
 
-def bedrock_agent_tool(action_group: Optional[str] = None):
+@dataclass(slots=True)
+class ToolRecord:
+    """What dispatch needs to know about a registered tool, computed once at registration."""
+    name: str
+    func: Callable
+    action_group: Optional[str]
+    validator: Callable[[dict], dict]
+    # Everything the generated schema depends on, to detect a stale precomputed schema
+    fingerprint: str
+    # Pool the tool runs in and the cap it declares for it, see ToolExecutor
+    concurrency_key: str
+    max_concurrency: Optional[int] = None
+    process: bool = False
+
+
+# Function name -> tool record, for dispatch without re-introspecting every tool
+_tool_registry: Dict[str, ToolRecord] = {}
+
+# Runs tool calls with the concurrency limits declared on @bedrock_agent_tool
+_tool_executor = ToolExecutor()
+
+
+def bedrock_agent_tool(
+        action_group: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        concurrency_scope: str = "tool",
+        process: bool = False
+):
+    """
+    Register a function as a tool of the agent.
+
+    Args:
+        action_group: action group the tool belongs to
+        max_concurrency: how many calls of the tool may run at once, across all sessions
+        concurrency_scope: "tool" for a cap of its own, or "action_group" to share one pool
+            (and the smallest declared cap) with the other tools of the action group
+        process: run the tool in a worker process, for CPU-bound tools. Its arguments and
+            result must be picklable.
+    """
+    if concurrency_scope not in ("tool", "action_group"):
+        raise ValueError(f"concurrency_scope must be 'tool' or 'action_group', got {concurrency_scope!r}")
+
     def decorator(func):
+        if process and func.__module__ == "__main__":
+            # Worker processes look the tool up by module, and __main__ is a different module there
+            raise ValueError(f"Tool {func.__name__} runs in a process, so it cannot be defined in __main__")
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             return func(*args, **kwargs)
 
+        concurrency_key = (f"action_group:{action_group}"
+                           if concurrency_scope == "action_group" and action_group else func.__name__)
+        _tool_executor.declare(concurrency_key, max_concurrency)
+
         # Store the function and its metadata
         func._action_group = action_group
         _decorated_functions.append(func)
+        _tool_registry[func.__name__] = ToolRecord(
+            name=func.__name__,
+            func=func,
+            action_group=action_group,
+            validator=compile_validator(func),
+            fingerprint=f"{func.__name__}|{action_group}|{inspect.signature(func)}|{func.__doc__}",
+            concurrency_key=concurrency_key,
+            max_concurrency=max_concurrency,
+            process=process,
+        )
         return wrapper
 
     return decorator
 
 
+def set_tool_executor(executor: ToolExecutor) -> None:
+    """
+    Replace the executor tool calls run on, e.g. to change the default concurrency cap.
+
+    The replaced executor is shut down; calls already submitted to it still complete.
+    """
+    global _tool_executor
+    for tool in _tool_registry.values():
+        executor.declare(tool.concurrency_key, tool.max_concurrency)
+    previous, _tool_executor = _tool_executor, executor
+    previous.shutdown(wait=False)
+
+
+def get_tool_metrics() -> Dict[str, Dict[str, Any]]:
+    """Queueing metrics of the tool pools, keyed by tool name or action group."""
+    return _tool_executor.metrics()
+
+
+class ToolCallValidationError(ValueError):
+    """Raised when the parameters of a tool call do not match the tool's signature."""
+
+    def __init__(self, function: str, errors: list):
+        super().__init__(f"Invalid parameters for {function}: " + "; ".join(
+            f"{error['parameter']}: {error['message']}" for error in errors))
+        self.function = function
+        self.errors = errors
+
+    def to_dict(self) -> dict:
+        """Structured form of the error, suitable for returning to the model."""
+        return {
+            'error': 'invalid_parameters',
+            'function': self.function,
+            'details': self.errors,
+        }
+
+
+_TRUE_STRINGS = frozenset(('true', 't', 'yes', 'y', '1'))
+_FALSE_STRINGS = frozenset(('false', 'f', 'no', 'n', '0'))
+_NULL_STRINGS = frozenset(('', 'null', 'none'))
+
+
+def _coerce_str(value):
+    return value if isinstance(value, str) else str(value)
+
+
+def _coerce_int(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    text = str(value).strip()
+    try:
+        return int(text)
+    except ValueError:
+        # Models sometimes send "1600.0"; accept it as long as no information is lost
+        try:
+            number = float(text)
+        except ValueError:
+            number = None
+        if number is None or not number.is_integer():
+            raise ValueError(f"expected an integer, got {value!r}")
+        return int(number)
+
+
+def _coerce_float(value):
+    if isinstance(value, float):
+        return value
+    try:
+        return float(str(value).strip())
+    except ValueError:
+        raise ValueError(f"expected a number, got {value!r}") from None
+
+
+def _coerce_bool(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in _TRUE_STRINGS:
+        return True
+    if text in _FALSE_STRINGS:
+        return False
+    raise ValueError(f"expected a boolean, got {value!r}")
+
+
+def _json_coercer(expected_type: type):
+    def coerce(value):
+        if isinstance(value, str):
+            value = json.loads(value)
+        if not isinstance(value, expected_type):
+            raise ValueError(f"expected {expected_type.__name__}, got {type(value).__name__}")
+        return value
+    return coerce
+
+
+_COERCERS = {
+    str: _coerce_str,
+    int: _coerce_int,
+    float: _coerce_float,
+    bool: _coerce_bool,
+    list: _json_coercer(list),
+    dict: _json_coercer(dict),
+}
+
+
+def _coercer_for_annotation(annotation) -> Optional[Callable]:
+    """Return the coercer for a parameter annotation, or None to pass values through unchanged."""
+    if annotation is inspect.Parameter.empty:
+        return None
+    # Optional[X] and X | None -> X, list[str] -> list
+    args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+    if typing.get_origin(annotation) in (typing.Union, types.UnionType) and len(args) == 1:
+        annotation = args[0]
+    return _COERCERS.get(typing.get_origin(annotation) or annotation)
+
+
+def compile_validator(func: Callable) -> Callable[[dict], dict]:
+    """
+    Compile a validator for a tool's parameters from its signature.
+
+    The signature is introspected once; the returned callable only loops over a
+    precomputed tuple of parameter specs, so it is cheap to run on every tool call.
+
+    Args:
+        func: the tool function
+    Returns:
+        Callable: takes the raw parameters from Bedrock and returns keyword arguments
+        for func, or raises ToolCallValidationError
+    """
+    specs = tuple(
+        (name, _coercer_for_annotation(param.annotation), param.default is inspect.Parameter.empty)
+        for name, param in inspect.signature(func).parameters.items()
+        if param.kind not in (inspect.Parameter.VAR_POSITIONAL, inspect.Parameter.VAR_KEYWORD)
+    )
+    known_names = frozenset(spec[0] for spec in specs)
+    function_name = func.__name__
+
+    def validate(parameters: dict) -> dict:
+        kwargs = {}
+        errors = None
+        for name, coerce, required in specs:
+            value = parameters.get(name)
+            # Treat "null"-like values for optional parameters as omitted, so the default applies
+            if value is None or (isinstance(value, str) and value.strip().lower() in _NULL_STRINGS):
+                if required:
+                    errors = errors or []
+                    errors.append({'parameter': name, 'message': 'missing required parameter'})
+                continue
+            if coerce is None:
+                kwargs[name] = value
+                continue
+            try:
+                kwargs[name] = coerce(value)
+            except (TypeError, ValueError) as e:
+                errors = errors or []
+                errors.append({'parameter': name, 'message': str(e)})
+
+        if not known_names.issuperset(parameters):
+            for name in parameters:
+                if name not in known_names:
+                    errors = errors or []
+                    errors.append({'parameter': name, 'message': 'unknown parameter'})
+
+        if errors:
+            raise ToolCallValidationError(function_name, errors)
+        return kwargs
+
+    return validate
+
+
 def parse_docstring(docstring: Optional[str]) -> tuple[str, Dict[str, str]]:
     """Parse a docstring to extract function description and parameter descriptions."""
     if not docstring:
@@ -122,13 +357,57 @@ def get_bedrock_tools(include_callable=True):
     return tools
 
 
+def _completed(result) -> Future:
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def submit_tool(function_to_call: dict) -> Future:
+    """
+    Validate the parameters of a tool call and schedule the tool on the tool executor.
+
+    Validation happens on the calling thread, so invalid calls never wait for a slot.
+
+    Args:
+        function_to_call: dict with the 'function' name and its raw 'parameters'
+    Returns:
+        Future: resolves to the same (result, error) tuple as invoke_tool, or raises what the tool raised
+    """
+    tool = _tool_registry.get(function_to_call['function'])
+    if tool is None:
+        return _completed((None, f"Error no function exists by name {function_to_call['function']}"))
+
+    try:
+        kwargs = tool.validator(function_to_call.get('parameters') or {})
+    except ToolCallValidationError as e:
+        return _completed((None, e))
+
+    call = _tool_executor.submit(tool.concurrency_key, tool.func, kwargs, tool.process)
+    result = Future()
+
+    def on_done(future: Future) -> None:
+        error = future.exception()
+        if error is not None:
+            result.set_exception(error)
+        else:
+            result.set_result((future.result(), None))
+
+    call.add_done_callback(on_done)
+    return result
+
+
 def invoke_tool(function_to_call: dict):
-    tools = get_bedrock_tools()
-    for tool in tools:
-        if tool['function'] == function_to_call['function']:
-            return tool['callable'](**function_to_call['parameters']), None
+    """
+    Validate the parameters of a tool call and invoke the tool, waiting for its result.
 
-    return None, f"Error no function exists by name {function_to_call['function']}"
+    Args:
+        function_to_call: dict with the 'function' name and its raw 'parameters'
+    Returns:
+        tuple: (result, error). error is a ToolCallValidationError when the parameters
+        are invalid, so it can be returned to the model, or a string for other failures.
+    """
+    return submit_tool(function_to_call).result()
 
 
 def convert_tools_to_function_schema(tools: list) -> list:
@@ -189,47 +468,201 @@ def convert_tools_to_function_schema(tools: list) -> list:
 
     return result
 
+# Bounds for the fallback search over returnControl payloads of unknown shape
+_FALLBACK_MAX_DEPTH = 4
+_FALLBACK_MAX_NODES = 256
+
+
+@dataclass(slots=True)
+class InvocationInput:
+    """A single function or API invocation requested by the agent through returnControl."""
+    invocation_id: Optional[str]
+    invocation_type: str  # 'function' or 'api'
+    action_group: Optional[str]
+    agent_id: Optional[str]
+    parameters: Dict[str, Any]
+    function: Optional[str] = None
+    api_path: Optional[str] = None
+    http_method: Optional[str] = None
+    request_body: Optional[Dict[str, Any]] = None
+
+    def to_function_call(self) -> dict:
+        """Return the dict format consumed by invoke_tool."""
+        return {
+            'invocationId': self.invocation_id,
+            'actionGroup': self.action_group,
+            'function': self.function,
+            'agentId': self.agent_id,
+            'parameters': self.parameters,
+        }
+
+
+def _parameters_to_dict(parameters) -> Dict[str, Any]:
+    return {param['name']: param['value'] for param in parameters or ()
+            if 'name' in param and 'value' in param}
+
+
+def _function_invocation(invocation_id: Optional[str], func_input: dict) -> InvocationInput:
+    return InvocationInput(
+        invocation_id=invocation_id,
+        invocation_type='function',
+        action_group=func_input.get('actionGroup'),
+        agent_id=func_input.get('agentId'),
+        parameters=_parameters_to_dict(func_input.get('parameters')),
+        function=func_input.get('function'),
+    )
+
+
+def _api_invocation(invocation_id: Optional[str], api_input: dict) -> InvocationInput:
+    request_body = None
+    content = (api_input.get('requestBody') or {}).get('content')
+    if content:
+        request_body = {media_type: _parameters_to_dict(body.get('properties'))
+                        for media_type, body in content.items()}
+    return InvocationInput(
+        invocation_id=invocation_id,
+        invocation_type='api',
+        action_group=api_input.get('actionGroup'),
+        agent_id=api_input.get('agentId'),
+        parameters=_parameters_to_dict(api_input.get('parameters')),
+        api_path=api_input.get('apiPath'),
+        http_method=api_input.get('httpMethod'),
+        request_body=request_body,
+    )
+
+
+def _to_invocation(invocation_id: Optional[str], invocation_input) -> Optional[InvocationInput]:
+    if not isinstance(invocation_input, dict):
+        return None
+    func_input = invocation_input.get('functionInvocationInput')
+    if func_input is not None:
+        return _function_invocation(invocation_id, func_input)
+    api_input = invocation_input.get('apiInvocationInput')
+    if api_input is not None:
+        return _api_invocation(invocation_id, api_input)
+    return None
+
+
+def _find_invocation_inputs(data) -> list:
+    """Breadth-first search for invocation inputs in a payload of unknown shape, bounded in depth and size."""
+    found = []
+    queue = [(data, 0)]
+    visited = 0
+    while queue and visited < _FALLBACK_MAX_NODES:
+        next_queue = []
+        for obj, depth in queue:
+            visited += 1
+            if isinstance(obj, dict):
+                if 'functionInvocationInput' in obj or 'apiInvocationInput' in obj:
+                    found.append(obj)
+                    continue
+                children = obj.values()
+            elif isinstance(obj, list):
+                children = obj
+            else:
+                continue
+            if depth < _FALLBACK_MAX_DEPTH:
+                next_queue.extend((child, depth + 1) for child in children
+                                  if isinstance(child, (dict, list)))
+        queue = next_queue
+    return found
+
+
+def extract_invocation_inputs(return_control: dict) -> list:
+    """
+    Extract the invocations requested by the agent from a returnControl payload.
+
+    Reads the documented shape, invocationInputs[*].functionInvocationInput or
+    apiInvocationInput, directly. Only payloads of another shape fall back to a
+    bounded search.
+
+    Args:
+        return_control: the 'returnControl' payload from the response stream
+    Returns:
+        list: InvocationInput records, in the order the agent requested them
+    """
+    invocation_id = return_control.get('invocationId')
+    invocation_inputs = return_control.get('invocationInputs')
+    if not isinstance(invocation_inputs, list):
+        invocation_inputs = _find_invocation_inputs(return_control)
+
+    invocations = [invocation for invocation in
+                   (_to_invocation(invocation_id, invocation_input) for invocation_input in invocation_inputs)
+                   if invocation is not None]
+    if not invocations and invocation_inputs:
+        # Documented key present but with unexpected entries; search below it
+        invocations = [invocation for invocation in
+                       (_to_invocation(invocation_id, invocation_input)
+                        for invocation_input in _find_invocation_inputs(invocation_inputs))
+                       if invocation is not None]
+
+    return invocations
+
+
+def tools_content_hash() -> str:
+    """Hash of the name, action group, signature and docstring of every registered tool."""
+    digest = hashlib.sha256()
+    for tool in _tool_registry.values():
+        digest.update(tool.fingerprint.encode('utf-8'))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def write_function_schema(path: str) -> list:
+    """
+    Generate the action group schemas of the registered tools and save them with their content hash.
+
+    Args:
+        path: path of the JSON artifact to write
+    Returns:
+        list: the action group schemas
+    """
+    schema = convert_tools_to_function_schema(get_bedrock_tools(include_callable=False))
+    with open(path, 'w') as f:
+        json.dump({'tools_hash': tools_content_hash(), 'action_groups': schema}, f, indent=2)
+        f.write("\n")
+    return schema
+
+
+def load_function_schema(path: str) -> list:
+    """
+    Load the precomputed action group schemas, if they still match the registered tools.
+
+    Falls back to generating the schemas from the registered tools when the artifact is
+    missing or was generated from different tools.
+
+    Args:
+        path: path of the JSON artifact written by write_function_schema
+    Returns:
+        list: the action group schemas
+    """
+    if os.path.exists(path):
+        try:
+            with open(path, 'r') as f:
+                artifact = json.load(f)
+            if artifact.get('tools_hash') == tools_content_hash():
+                return artifact['action_groups']
+            print(f"Precomputed tool schema {path} is stale, regenerating it in memory")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Could not load precomputed tool schema {path}: {e}")
+    return convert_tools_to_function_schema(get_bedrock_tools(include_callable=False))
+
+
 def parse_function_parameters(data):
     """
-    Recursively parse a dictionary to extract function invocation parameters.
-    Returns a dictionary of parameter name-value pairs.
+    Extract the function invocation from a returnControl payload.
 
     Args:
-        data (dict or list): The input data structure to parse
+        data (dict): The returnControl payload
 
     Returns:
-        dict: A dictionary mapping parameter names to their values
+        dict: invocationId, actionGroup, function, agentId and a dictionary mapping
+        parameter names to their values for the first function invocation
     """
-    function_to_call = {}
-    function_to_call['invocationId'] = data['invocationId']
-
-    def recursive_extract(obj):
-        if isinstance(obj, dict):
-            # Check if we've found a functionInvocationInput
-            if 'functionInvocationInput' in obj:
-                func_input = obj['functionInvocationInput']
-                # Extract function metadata
-                function_to_call['actionGroup'] = func_input.get('actionGroup')
-                function_to_call['function'] = func_input.get('function')
-                function_to_call['agentId'] = func_input.get('agentId')
-                function_to_call['parameters'] = {}
-                # Process parameters list if it exists
-                if 'parameters' in func_input:
-                    for param in func_input['parameters']:
-                        if all(key in param for key in ['name', 'value']):
-                            function_to_call['parameters'][param['name']] = param['value']
-
-            # Continue searching through all dictionary values
-            for value in obj.values():
-                recursive_extract(value)
-
-        elif isinstance(obj, list):
-            # Search through all list items
-            for item in obj:
-                recursive_extract(item)
-
-    recursive_extract(data)
-    return function_to_call
+    for invocation in extract_invocation_inputs(data):
+        if invocation.invocation_type == 'function':
+            return invocation.to_function_call()
+    return {'invocationId': data.get('invocationId')}
 
 
 if __name__ == "__main__":
@@ -1,16 +1,18 @@
 import json
+import os
 from datetime import datetime
 import uuid
 
-from bedrock_agent_helper import BedrockAgent
-from function_calls import get_bedrock_tools, convert_tools_to_function_schema
-from location_tools import search_near
+from bedrock_agent_helper import BedrockAgent, TraceMode
+from function_calls import load_function_schema, write_function_schema
+from location_tools import search_near, set_client_ip, prefetch_location
 from weather_tools import get_weather
 
+# Precomputed with `python intialize_agent.py`; regenerated in memory if the tools changed
+SCHEMA_ARTIFACT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "action_groups_schema.json")
 
 # Get the bedrock tools and convert to function schema
-tools = get_bedrock_tools()
-action_groups_schema = convert_tools_to_function_schema(tools)
+action_groups_schema = load_function_schema(SCHEMA_ARTIFACT_PATH)
 
 #print(json.dumps(action_groups_schema, indent=4))
 
@@ -29,13 +31,25 @@ DEFAULT_INSTRUCTIONS = """
 
 DEFAULT_MODEL = "us.amazon.nova-pro-v1:0"
 
-def initialize(session_id: str, instructions=None, model_id=None):
+def initialize(session_id: str, instructions=None, model_id=None, client_ip=None, prefetch_geoip=False,
+               trace_mode=TraceMode.FULL, client=None, response_cache=None, profiler=None, event_log=None):
+    # Resolve the user's location per client IP, optionally ahead of the first tool call
+    set_client_ip(client_ip)
+    if prefetch_geoip:
+        prefetch_location(client_ip)
+
     # Initialize the agent
     agent = BedrockAgent(
         session_id=session_id,
         model_id=model_id if model_id is not None else DEFAULT_MODEL,
         action_groups=action_groups_schema,
         instructions=instructions if instructions is not None else DEFAULT_INSTRUCTIONS,
+        trace_mode=trace_mode,
+        client=client,
+        response_cache=response_cache,
+        cache_context=client_ip,
+        profiler=profiler,
+        event_log=event_log,
     )
 
     # Set up session attributes
@@ -44,4 +58,9 @@ def initialize(session_id: str, instructions=None, model_id=None):
         'radius': '100',
     }
 
-    return agent, session_attributes
\ No newline at end of file
+    return agent, session_attributes
+
+
+if __name__ == "__main__":
+    write_function_schema(SCHEMA_ARTIFACT_PATH)
+    print(f"Wrote {SCHEMA_ARTIFACT_PATH}")
@@ -1,9 +1,12 @@
 # Constants
 import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Optional, Tuple
 from urllib.parse import urlencode
 
-import geocoder
-import httpx
 from function_calls import bedrock_agent_tool, get_bedrock_tools
 import json
 
@@ -11,7 +14,21 @@ FSQ_PLACES_API_BASE = "https://places-api.foursquare.com"
 
 FSQ_SERVICE_TOKEN = os.getenv("FOURSQUARE_SERVICE_TOKEN")
 
+# How long a resolved IP location stays valid, and how many client IPs we remember
+GEOIP_CACHE_TTL = float(os.getenv("GEOIP_CACHE_TTL", "3600"))
+GEOIP_CACHE_MAX_ENTRIES = int(os.getenv("GEOIP_CACHE_MAX_ENTRIES", "1024"))
+
+# Client IP of the current session (e.g. forwarded by the UI); None means "this machine"
+_client_ip: ContextVar[Optional[str]] = ContextVar("client_ip", default=None)
+
+# ip -> (expires_at, future resolving to (lat, lng) or None)
+_geoip_cache: dict[str, Tuple[float, Future]] = {}
+_geoip_lock = threading.Lock()
+_geoip_executor: Optional[ThreadPoolExecutor] = None
+
 def submit_request(endpoint: str, params: dict[str, str]) -> str:
+    import httpx
+
     headers = {
         "Authorization": f"Bearer {FSQ_SERVICE_TOKEN}",
         "X-Places-Api-Version": "2025-02-05"
@@ -28,6 +45,85 @@ def submit_request(endpoint: str, params: dict[str, str]) -> str:
             return "null", str(e)
             #return "Lake Washington Park; Summit at Snoqualmie Skiing; Rocket Bowling", None
 
+def set_client_ip(ip: Optional[str]) -> None:
+    """Set the client IP used by get_location for the current session/context."""
+    _client_ip.set(ip or None)
+
+
+def get_client_ip() -> Optional[str]:
+    """Return the client IP set for the current session/context, if any."""
+    return _client_ip.get()
+
+
+def _lookup_ip(ip: str) -> Optional[Tuple[float, float]]:
+    import geocoder
+
+    location = geocoder.ip(ip)
+    if not location.ok:
+        return None
+    return location.lat, location.lng
+
+
+def _evict_geoip_entries(now: float) -> None:
+    """Drop expired entries, then the oldest ones, until the cache fits. Caller holds the lock."""
+    for key in [key for key, (expires_at, _) in _geoip_cache.items() if expires_at <= now]:
+        del _geoip_cache[key]
+    while len(_geoip_cache) >= GEOIP_CACHE_MAX_ENTRIES:
+        del _geoip_cache[next(iter(_geoip_cache))]
+
+
+def resolve_location(ip: Optional[str] = None, background: bool = False) -> Future:
+    """
+    Resolve the approximate location of an IP address, at most once per TTL.
+
+    Args:
+        ip: client IP address to look up. None looks up the IP of this machine.
+        background: if True, the lookup runs on a worker thread and this call returns immediately.
+    Returns:
+        Future: resolves to a (latitude, longitude) tuple, or None if the location is unknown
+    """
+    global _geoip_executor
+    key = ip or "me"
+    now = time.monotonic()
+    with _geoip_lock:
+        entry = _geoip_cache.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+
+        _evict_geoip_entries(now)
+        if background:
+            if _geoip_executor is None:
+                _geoip_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="geoip")
+            future = _geoip_executor.submit(_lookup_ip, key)
+        else:
+            future = Future()
+        _geoip_cache[key] = (now + GEOIP_CACHE_TTL, future)
+
+    if not background:
+        try:
+            future.set_result(_lookup_ip(key))
+        except Exception as e:
+            future.set_exception(e)
+
+    # Failed lookups are not worth remembering for a whole TTL
+    future.add_done_callback(lambda f: _forget_failed_lookup(key, f))
+    return future
+
+
+def _forget_failed_lookup(key: str, future: Future) -> None:
+    if future.exception() is None and future.result() is not None:
+        return
+    with _geoip_lock:
+        entry = _geoip_cache.get(key)
+        if entry and entry[1] is future:
+            del _geoip_cache[key]
+
+
+def prefetch_location(ip: Optional[str] = None) -> Future:
+    """Start resolving the location of an IP in the background, e.g. at session start."""
+    return resolve_location(ip, background=True)
+
+
 @bedrock_agent_tool(action_group="LocationToolsActionGroup")
 def search_near(what: str, where: str=None, ll: str=None, radius: int=1600) -> str:
     """Search for places near a particular named region or point. Either the
@@ -62,12 +158,17 @@ def get_location() -> str:
 
     """
 
-    location = geocoder.ip('me')
+    try:
+        location = resolve_location(get_client_ip()).result()
+    except Exception as e:
+        print(e)
+        location = None
 
-    if not location.ok:
+    if location is None:
         return "I don't know where you are"
 
-    return f"{location.lat},{location.lng} (using geoip, so this is an approximation)"
+    lat, lng = location
+    return f"{lat},{lng} (using geoip, so this is an approximation)"
 
 @bedrock_agent_tool(action_group="LocationToolsActionGroup")
 def place_from_latitude_and_longitude(ll: str) -> str:
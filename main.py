@@ -1,17 +1,17 @@
+import argparse
 import json
 from datetime import datetime
 import uuid
 
-from bedrock_agent_helper import BedrockAgent
-from function_calls import get_bedrock_tools, convert_tools_to_function_schema
-from location_tools import search_near
-from weather_tools import get_weather
+from bedrock_agent_helper import BedrockAgent, EventType
+from intialize_agent import action_groups_schema
+from turn_profiler import add_profiling_arguments, profiler_from_args
 
 # Example usage:
 if __name__ == "__main__":
-    # Get the bedrock tools and convert to function schema
-    tools = get_bedrock_tools()
-    action_groups_schema = convert_tools_to_function_schema(tools)
+    parser = argparse.ArgumentParser(description="Chat with the agent from the terminal.")
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
 
     #print(json.dumps(action_groups_schema, indent=4))
 
@@ -24,7 +24,8 @@ if __name__ == "__main__":
             You are a helpful location aware agent.
             You search for things to do based on the context provided through the input.  
             Always Use the tools provided along with the context to provide the best answers to the human's questions.
-        """
+        """,
+        profiler=profiler_from_args(args)
     )
 
     # Set up session attributes
@@ -37,9 +38,7 @@ if __name__ == "__main__":
         command = input("Enter a command (or 'quit' to exit): ")
         if command.lower() == 'quit':
             break
-        # Make a query
-        response = agent.invoke_agent(
-            command,
-            session_attributes
-        )
-        print(response)
\ No newline at end of file
+        # Make a query; the turn only runs as its events are consumed
+        for event in agent.invoke_agent(command, session_attributes):
+            if event.type in (EventType.COMPLETION, EventType.ERROR):
+                print(event.data)
\ No newline at end of file
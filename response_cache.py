@@ -0,0 +1,148 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from enum import Enum
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class CacheMode(Enum):
+    EVENTS = "events"          # replay every event of the cached turn
+    COMPLETION = "completion"  # replay only the final completion
+
+
+class ResponseCache:
+    """
+    Bounded, thread safe cache of complete agent turns.
+
+    A turn is keyed by the model id, or the models a router may pick from, a hash of the
+    instructions, the normalized input text, the relevant session attributes, the trace mode
+    the turn's events were produced with and an optional context such as the client IP. Only the first turn of a session is ever served from or
+    stored in the cache: later turns depend on the conversation so far, which the key cannot
+    capture. The cache remembers which sessions have already had a turn, so this also holds
+    when agents are recreated for a session.
+
+    A turn served from the cache never reaches Bedrock. The cache keeps the replayed exchange
+    per session until the session's next turn, which sends it to the model as conversation
+    history, see replayed_history.
+    """
+
+    def __init__(
+            self,
+            max_entries: int = 1024,
+            ttl: float = 15 * 60,
+            mode: CacheMode = CacheMode.EVENTS,
+            relevant_attributes: Optional[Iterable[str]] = None,
+            max_sessions: int = 100000
+    ):
+        """
+        Args:
+            max_entries: maximum number of cached turns, least recently used are dropped first
+            ttl: seconds a cached turn stays valid
+            mode: whether to replay all events of a turn or only its completion
+            relevant_attributes: session attributes that are part of the key. None means all of them.
+            max_sessions: how many session ids, and replayed exchanges, to remember
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.mode = CacheMode(mode)
+        self.relevant_attributes = tuple(sorted(relevant_attributes)) if relevant_attributes is not None else None
+        self.max_sessions = max_sessions
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, list]]" = OrderedDict()
+        # Session id -> conversation history messages of a turn replayed from the cache, if any
+        self._sessions_with_history: "OrderedDict[str, Optional[list]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize_input(input_text: str) -> str:
+        return " ".join(input_text.lower().split())
+
+    def make_key(
+            self,
+            model_id: str,
+            instructions: str,
+            input_text: str,
+            session_attributes: Dict[str, Any],
+            context: Any = None,
+            trace_mode: Optional[str] = None
+    ) -> str:
+        """Build the cache key of a turn."""
+        if self.relevant_attributes is not None:
+            session_attributes = {name: session_attributes.get(name) for name in self.relevant_attributes}
+        key = json.dumps([
+            model_id,
+            hashlib.sha256(instructions.encode('utf-8')).hexdigest(),
+            self.normalize_input(input_text),
+            session_attributes,
+            context,
+            trace_mode,
+        ], sort_keys=True, default=str)
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def start_turn(self, session_id: str) -> bool:
+        """
+        Record that a session is starting a turn.
+
+        Returns:
+            bool: True if this is the first turn of the session, i.e. it may use the cache
+        """
+        with self._lock:
+            first_turn = session_id not in self._sessions_with_history
+            if first_turn:
+                self._sessions_with_history[session_id] = None
+            self._sessions_with_history.move_to_end(session_id)
+            while len(self._sessions_with_history) > self.max_sessions:
+                self._sessions_with_history.popitem(last=False)
+        return first_turn
+
+    def record_replay(self, session_id: str, input_text: str, completion: str) -> None:
+        """Remember a turn served from the cache, so the session's next turn can send it as history."""
+        messages = [
+            {'role': 'user', 'content': [{'text': input_text}]},
+            {'role': 'assistant', 'content': [{'text': completion}]},
+        ]
+        with self._lock:
+            if session_id in self._sessions_with_history:
+                self._sessions_with_history[session_id] = messages
+
+    def replayed_history(self, session_id: str) -> Optional[list]:
+        """Conversation history messages of a replayed turn that Bedrock has not seen yet, or None."""
+        with self._lock:
+            return self._sessions_with_history.get(session_id)
+
+    def forget_replayed_history(self, session_id: str) -> None:
+        """Record that the replayed turn of a session has been sent to Bedrock."""
+        with self._lock:
+            if session_id in self._sessions_with_history:
+                self._sessions_with_history[session_id] = None
+
+    def get(self, key: str) -> Optional[list]:
+        """Return the cached events of a turn, or None."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, events: List[Any]) -> None:
+        """Store the events of a completed turn, keeping only what the cache mode replays."""
+        if self.mode is CacheMode.COMPLETION:
+            events = events[-1:]
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, events)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
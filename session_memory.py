@@ -0,0 +1,140 @@
+import json
+import os
+import threading
+from collections import deque
+from collections.abc import Mapping
+from typing import Any, Iterator, Optional
+
+from bedrock_agent_helper import AgentEvent, EventType, LazyTrace
+
+# Events whose payloads are shed first when a session is over its budget, in this order
+_SHEDDABLE_TYPES = (EventType.TRACE, EventType.FUNCTION_CALL, EventType.FUNCTION_RESULT)
+
+
+def estimate_size(obj: Any, max_depth: int = 8) -> int:
+    """Rough number of bytes held by a decoded payload; strings and bytes dominate in practice."""
+    if isinstance(obj, (str, bytes)):
+        return len(obj) + 50
+    if isinstance(obj, LazyTrace):
+        obj = obj.raw
+    if max_depth == 0:
+        return 64
+    if isinstance(obj, Mapping):
+        return 64 + sum(estimate_size(key, max_depth - 1) + estimate_size(value, max_depth - 1)
+                        for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return 56 + sum(estimate_size(item, max_depth - 1) for item in obj)
+    return 32
+
+
+class SpilledPayload:
+    """Reference to an event payload that was moved to a spill file."""
+    __slots__ = ('path', 'offset', 'length')
+
+    def __init__(self, path: str, offset: int, length: int):
+        self.path = path
+        self.offset = offset
+        self.length = length
+
+    def load(self) -> Any:
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            return json.loads(f.read(self.length))
+
+    def __repr__(self):
+        return f"SpilledPayload({self.path!r}, offset={self.offset}, length={self.length})"
+
+
+class EventLog:
+    """
+    Events of a session, kept within a memory budget.
+
+    Events are kept by reference, not copied. When the estimated size of the payloads goes
+    over max_bytes, the payloads of the oldest traces, then of the oldest tool calls and
+    results, are spilled to spill_path if one is given, or dropped otherwise. Their events stay
+    in the log with a SpilledPayload or None as data. If that is not enough, the oldest events
+    are dropped entirely. spilled, shed and dropped count spilled payloads, dropped payloads and
+    dropped events.
+    """
+    __slots__ = ('max_bytes', 'spill_path', 'total_bytes', 'spilled', 'shed', 'dropped', '_events', '_sheddable',
+                 '_lock')
+
+    def __init__(self, max_bytes: int = 4 * 1024 * 1024, spill_path: Optional[str] = None):
+        """
+        Args:
+            max_bytes: memory budget for the payloads of the session's events
+            spill_path: file old payloads are appended to instead of being dropped
+        """
+        self.max_bytes = max_bytes
+        self.spill_path = spill_path
+        self.total_bytes = 0
+        self.spilled = 0
+        self.shed = 0
+        self.dropped = 0
+        self._events: deque = deque()  # [event, estimated size] pairs, oldest first
+        # Entries of _events whose payloads can still be shed, per event type, oldest first
+        self._sheddable = {event_type: deque() for event_type in _SHEDDABLE_TYPES}
+        self._lock = threading.Lock()
+
+    def append(self, event: AgentEvent) -> None:
+        size = estimate_size(event.data)
+        with self._lock:
+            entry = [event, size]
+            self._events.append(entry)
+            if event.type in self._sheddable and event.data is not None and not isinstance(event.data, SpilledPayload):
+                self._sheddable[event.type].append(entry)
+            self.total_bytes += size
+            if self.total_bytes > self.max_bytes:
+                self._shed()
+
+    def _shed(self) -> None:
+        """Bring the log back under budget. Caller holds the lock."""
+        for event_type in _SHEDDABLE_TYPES:
+            sheddable = self._sheddable[event_type]
+            while sheddable and self.total_bytes > self.max_bytes:
+                entry = sheddable.popleft()
+                event, size = entry
+                entry[0] = AgentEvent(type=event.type, data=self._spill(event.data), cached=event.cached)
+                entry[1] = 0
+                self.total_bytes -= size
+
+        # Still over budget only once every payload is shed, so dropped events are in no _sheddable queue
+        while self.total_bytes > self.max_bytes and len(self._events) > 1:
+            _, size = self._events.popleft()
+            self.total_bytes -= size
+            self.dropped += 1
+
+    def _spill(self, data: Any) -> Optional[SpilledPayload]:
+        if self.spill_path is None:
+            self.shed += 1
+            return None
+        if isinstance(data, LazyTrace):
+            data = data.raw
+        payload = json.dumps(data, default=str).encode('utf-8')
+        with open(self.spill_path, 'ab') as f:
+            offset = f.tell()
+            f.write(payload + b"\n")
+        self.spilled += 1
+        return SpilledPayload(self.spill_path, offset, len(payload))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._events.clear()
+            for sheddable in self._sheddable.values():
+                sheddable.clear()
+            self.total_bytes = 0
+        if self.spill_path and os.path.exists(self.spill_path):
+            os.remove(self.spill_path)
+
+    def __iter__(self) -> Iterator[AgentEvent]:
+        with self._lock:
+            events = [event for event, _ in self._events]
+        return iter(events)
+
+    def __reversed__(self) -> Iterator[AgentEvent]:
+        with self._lock:
+            events = [event for event, _ in reversed(self._events)]
+        return iter(events)
+
+    def __len__(self) -> int:
+        return len(self._events)
@@ -0,0 +1,63 @@
+import unittest
+
+from agent_router import AgentRouter, RouteTarget, RoutingError, StubAgentClient, StubThrottlingException
+
+
+def read_completion(response):
+    return "".join(chunk['chunk']['bytes'].decode('utf-8') for chunk in response['completion'])
+
+
+class AgentRouterTest(unittest.TestCase):
+
+    def make_router(self, *clients, **kwargs):
+        targets = [RouteTarget(f"region-{index}", "model", client) for index, client in enumerate(clients)]
+        kwargs.setdefault('first_chunk_timeout', 0.5)
+        kwargs.setdefault('explore_rate', 0.0)
+        return AgentRouter(targets, **kwargs)
+
+    def test_fails_over_when_a_target_throttles(self):
+        router = self.make_router(StubAgentClient(0.0, throttle_rate=1.0), StubAgentClient(0.0))
+        response = router.invoke_inline_agent(sessionId="s1", inputText="hi")
+        self.assertEqual(response['routedTo'], "region-1/model")
+        self.assertEqual(read_completion(response), "Hello from a stub")
+        self.assertEqual(router.targets[0].error_rate, 1.0)
+
+    def test_fails_over_when_a_target_produces_no_first_chunk_in_time(self):
+        router = self.make_router(StubAgentClient(1.0), StubAgentClient(0.0), first_chunk_timeout=0.2)
+        response = router.invoke_inline_agent(sessionId="s1", inputText="hi")
+        self.assertEqual(response['routedTo'], "region-1/model")
+        read_completion(response)
+        self.assertGreater(router.targets[0].cooldown_until, 0)
+
+    def test_raises_when_every_target_fails(self):
+        router = self.make_router(StubAgentClient(0.0, throttle_rate=1.0), StubAgentClient(0.0, throttle_rate=1.0))
+        with self.assertRaises(RoutingError):
+            router.invoke_inline_agent(sessionId="s1", inputText="hi")
+
+    def test_session_stays_on_its_target(self):
+        first, second = StubAgentClient(0.0), StubAgentClient(0.0)
+        router = self.make_router(first, second)
+        response = router.invoke_inline_agent(sessionId="s1", inputText="hi")
+        read_completion(response)
+        routed_to = response['routedTo']
+        # Make the other target rank first from now on
+        other = next(target for target in router.targets if target.name != routed_to)
+        other.first_chunk_times.extend([0.0] * 10)
+        for _ in range(5):
+            response = router.invoke_inline_agent(sessionId="s1", inputText="again")
+            read_completion(response)
+            self.assertEqual(response['routedTo'], routed_to)
+        continuation = router.invoke_inline_agent(
+            sessionId="s1", inlineSessionState={'returnControlInvocationResults': []})
+        self.assertEqual(continuation['routedTo'], routed_to)
+
+    def test_mid_stream_errors_count_against_the_target(self):
+        router = self.make_router(StubAgentClient(0.0, fail_after_chunks=1))
+        response = router.invoke_inline_agent(sessionId="s1", inputText="hi")
+        with self.assertRaises(StubThrottlingException):
+            read_completion(response)
+        self.assertEqual(router.targets[0].error_rate, 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
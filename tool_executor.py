@@ -0,0 +1,193 @@
+import contextvars
+import importlib
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from turn_profiler import sampled_call
+
+
+def _call_in_process(module_name: str, function_name: str, kwargs: Dict[str, Any]) -> Any:
+    """Run a tool in a worker process, looking it up by name rather than pickling the function."""
+    module = importlib.import_module(module_name)
+    return getattr(module, function_name)(**kwargs)
+
+
+class _ToolPool:
+    """Threads running one tool, or one action group's tools, with its queueing metrics."""
+    __slots__ = ('key', 'max_concurrency', 'executor', 'submitted', 'completed', 'failed', 'queued',
+                 'running', 'total_wait', 'max_wait', 'total_run', '_lock')
+
+    def __init__(self, key: str, max_concurrency: int):
+        self.key = key
+        self.max_concurrency = max_concurrency
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=f"tool-{key}")
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.queued = 0
+        self.running = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+        self._lock = threading.Lock()
+
+    def submit(self, call: Callable[[], Any]) -> Future:
+        submitted_at = time.perf_counter()
+        with self._lock:
+            self.submitted += 1
+            self.queued += 1
+        return self.executor.submit(self._run, call, submitted_at)
+
+    def _run(self, call: Callable[[], Any], submitted_at: float) -> Any:
+        started_at = time.perf_counter()
+        wait = started_at - submitted_at
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+        failed = True
+        try:
+            result = call()
+            failed = False
+            return result
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.total_run += time.perf_counter() - started_at
+                if failed:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            finished = self.completed + self.failed
+            started = self.submitted - self.queued
+            return {
+                'max_concurrency': self.max_concurrency,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'queued': self.queued,
+                'running': self.running,
+                'avg_wait_ms': round(self.total_wait / started * 1000, 1) if started else 0.0,
+                'max_wait_ms': round(self.max_wait * 1000, 1),
+                'avg_run_ms': round(self.total_run / finished * 1000, 1) if finished else 0.0,
+            }
+
+
+class ToolExecutor:
+    """
+    Runs tool calls off the thread consuming the Bedrock stream, with per-tool concurrency limits.
+
+    Each tool gets its own thread pool, sized by the max_concurrency declared on
+    @bedrock_agent_tool, or default_max_concurrency. Tools declared with
+    concurrency_scope="action_group" share one pool per action group, capped by the smallest
+    max_concurrency declared among them. Calls beyond the cap wait in the pool's queue, and
+    the wait is reported by metrics().
+
+    Tools declared with process=True still take a slot in their thread pool, but run in a
+    shared process pool, so CPU-bound tools do not hold the GIL of the serving process. Their
+    arguments and results are pickled, and the tool is looked up by module and name in the
+    worker process.
+    """
+
+    def __init__(self, default_max_concurrency: int = 16, max_processes: Optional[int] = None):
+        """
+        Args:
+            default_max_concurrency: concurrency cap of tools that do not declare one
+            max_processes: size of the process pool for process=True tools, defaults to the CPU count
+        """
+        self.default_max_concurrency = default_max_concurrency
+        self.max_processes = max_processes or os.cpu_count() or 1
+        self._pools: Dict[str, _ToolPool] = {}
+        self._caps: Dict[str, int] = {}
+        self._process_pool = None
+        self._lock = threading.Lock()
+
+    def declare(self, key: str, max_concurrency: Optional[int]) -> None:
+        """
+        Record the concurrency cap a tool declares for its pool; the smallest one wins.
+
+        Raises ValueError if the cap would lower that of a pool that is already running calls.
+        """
+        if max_concurrency is None:
+            return
+        if max_concurrency < 1:
+            raise ValueError(f"max_concurrency must be at least 1, got {max_concurrency}")
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is not None and max_concurrency < pool.max_concurrency:
+                raise ValueError(f"Cannot lower the concurrency cap of {key!r} to {max_concurrency} "
+                                 f"once its pool runs with {pool.max_concurrency}")
+            self._caps[key] = min(max_concurrency, self._caps.get(key, max_concurrency))
+
+    def _pool(self, key: str) -> _ToolPool:
+        pool = self._pools.get(key)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(key)
+                if pool is None:
+                    pool = _ToolPool(key, self._caps.get(key, self.default_max_concurrency))
+                    self._pools[key] = pool
+        return pool
+
+    def _get_process_pool(self):
+        # multiprocessing is only imported once a process=True tool is called
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        with self._lock:
+            if self._process_pool is None:
+                # spawn, not fork: forking a process that runs threads can deadlock the child
+                self._process_pool = ProcessPoolExecutor(max_workers=self.max_processes,
+                                                         mp_context=multiprocessing.get_context("spawn"))
+            return self._process_pool
+
+    def submit(self, key: str, func: Callable, kwargs: Dict[str, Any], process: bool = False) -> Future:
+        """
+        Schedule a tool call in the pool of key.
+
+        Args:
+            key: the pool, as returned by the tool's concurrency key
+            func: the tool function
+            kwargs: validated keyword arguments for the tool
+            process: run the call in the process pool
+        Returns:
+            Future: resolves to the tool's return value
+        """
+        # Run with the caller's context variables, e.g. the client IP used by get_location, or
+        # the turn being profiled
+        context = contextvars.copy_context()
+        if process:
+            process_pool = self._get_process_pool()
+            module_name, function_name = func.__module__, func.__name__
+
+            def call():
+                return context.run(sampled_call, lambda: process_pool.submit(
+                    _call_in_process, module_name, function_name, kwargs).result())
+        else:
+            def call():
+                return context.run(sampled_call, func, **kwargs)
+
+        return self._pool(key).submit(call)
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """Queueing metrics per pool."""
+        with self._lock:
+            pools = list(self._pools.values())
+        return {pool.key: pool.metrics() for pool in pools}
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+            process_pool, self._process_pool = self._process_pool, None
+        for pool in pools:
+            pool.executor.shutdown(wait=wait)
+        if process_pool is not None:
+            process_pool.shutdown(wait=wait)
@@ -0,0 +1,204 @@
+import contextvars
+import cProfile
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+_END = object()
+
+# cProfile allows one active profiler per process on Python 3.12+, so turns are profiled one at a time
+_profiling_lock = threading.Lock()
+
+
+class _StackSampler(threading.Thread):
+    """
+    Samples the stacks of a turn's threads at a fixed interval and counts the collapsed stacks.
+
+    The thread consuming the turn is always sampled; tool threads are sampled while they run a
+    call for the turn. Each stack is rooted at the name of its thread.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="turn-profiler-sampler", daemon=True)
+        self.thread_ids = Counter({thread_id: 1})
+        self.interval = interval
+        self.stacks = Counter()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def add_thread(self, thread_id: int) -> None:
+        with self._lock:
+            self.thread_ids[thread_id] += 1
+
+    def remove_thread(self, thread_id: int) -> None:
+        with self._lock:
+            self.thread_ids[thread_id] -= 1
+            if self.thread_ids[thread_id] <= 0:
+                del self.thread_ids[thread_id]
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            with self._lock:
+                thread_ids = list(self.thread_ids)
+            frames = sys._current_frames()
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                names.append(thread_names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(names))] += 1
+
+    def stop(self) -> Counter:
+        self._stop_event.set()
+        self.join()
+        return self.stacks
+
+
+# Sampler of the turn being profiled in this context, seen by the tool calls it submits
+_current_sampler: contextvars.ContextVar[Optional[_StackSampler]] = contextvars.ContextVar(
+    "turn_profiler_sampler", default=None)
+
+
+def sampled_call(func: Callable[..., T], /, *args: Any, **kwargs: Any) -> T:
+    """
+    Call func, sampling the calling thread's stacks along with the turn being profiled, if any.
+
+    Tool calls run on executor threads that cProfile does not see; wrapping them with this,
+    within the submitting turn's context, puts their time in the turn's .folded file.
+    """
+    sampler = _current_sampler.get()
+    if sampler is None:
+        return func(*args, **kwargs)
+    thread_id = threading.get_ident()
+    sampler.add_thread(thread_id)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        sampler.remove_thread(thread_id)
+
+
+class TurnProfiler:
+    """
+    Profiles selected agent turns and writes one pstats and one collapsed-stack file per turn.
+
+    A turn is selected at random with probability sample_rate. With latency_threshold set, every
+    turn is profiled and its files are only kept if the turn took at least that long. While a turn
+    is profiled, cProfile records the thread consuming it, including whatever the caller does with
+    each event (e.g. UI rendering), and a sampler thread records its stacks for flamegraphs. Tool
+    calls run on other threads, so in the .pstats file their time shows up as Future.result waits;
+    the .folded file also samples the tool threads, through sampled_call. Only
+    one turn is profiled at a time; a selected turn overlapping a profiled one runs unprofiled. Files
+    are named <session id>-turn<turn number>.{pstats,folded}; the .folded file can be fed to
+    flamegraph.pl or speedscope.
+    """
+
+    def __init__(
+            self,
+            output_dir: str,
+            sample_rate: float = 0.0,
+            latency_threshold: Optional[float] = None,
+            sampling_interval: float = 0.005
+    ):
+        """
+        Args:
+            output_dir: directory the profile files are written to
+            sample_rate: share of turns to profile, between 0 and 1
+            latency_threshold: if set, profile every turn but only keep turns slower than this many seconds
+            sampling_interval: seconds between two stack samples
+        """
+        self.output_dir = output_dir
+        self.sample_rate = sample_rate
+        self.latency_threshold = latency_threshold
+        self.sampling_interval = sampling_interval
+        os.makedirs(output_dir, exist_ok=True)
+
+    def should_profile(self) -> bool:
+        return self.latency_threshold is not None or random.random() < self.sample_rate
+
+    def profile_turn(self, events: Iterator[T], session_id: str, turn: int) -> Iterator[T]:
+        """Wrap the events of a turn, profiling their production and consumption if the turn is selected."""
+        if not self.should_profile() or not _profiling_lock.acquire(blocking=False):
+            yield from events
+            return
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler, not started by us, is active
+            _profiling_lock.release()
+            yield from events
+            return
+
+        start = time.perf_counter()
+        sampler = None
+        try:
+            sampler = _StackSampler(threading.get_ident(), self.sampling_interval)
+            sampler.start()
+            iterator = iter(events)
+            try:
+                while True:
+                    # Only set while the turn itself runs, so tools it submits are sampled with it
+                    token = _current_sampler.set(sampler)
+                    try:
+                        event = next(iterator, _END)
+                    finally:
+                        _current_sampler.reset(token)
+                    if event is _END:
+                        break
+                    yield event
+            finally:
+                close = getattr(iterator, 'close', None)
+                if close is not None:
+                    close()
+        finally:
+            profile.disable()
+            _profiling_lock.release()
+            if sampler is not None:
+                stacks = sampler.stop()
+                elapsed = time.perf_counter() - start
+                if self.latency_threshold is None or elapsed >= self.latency_threshold:
+                    self._write(profile, stacks, session_id, turn, elapsed)
+
+    def _write(self, profile: cProfile.Profile, stacks: Counter, session_id: str, turn: int, elapsed: float) -> None:
+        safe_session_id = re.sub(r"[^A-Za-z0-9_.-]", "_", session_id)
+        base_path = os.path.join(self.output_dir, f"{safe_session_id}-turn{turn:04d}")
+        profile.dump_stats(base_path + ".pstats")
+        with open(base_path + ".folded", "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"Profiled turn {turn} of session {session_id} ({elapsed * 1000:.0f} ms): {base_path}.pstats")
+
+
+def add_profiling_arguments(parser) -> None:
+    """Add the profiling options shared by the command line entry points to an argparse parser."""
+    group = parser.add_argument_group("profiling")
+    group.add_argument("--profile-dir", default=None, help="write per-turn profiles to this directory")
+    group.add_argument("--profile-sample-rate", type=float, default=1.0,
+                       help="with --profile-dir, share of turns to profile (default: all)")
+    group.add_argument("--profile-threshold-ms", type=float, default=None,
+                       help="with --profile-dir, only keep profiles of turns slower than this")
+
+
+def profiler_from_args(args) -> Optional[TurnProfiler]:
+    """Build the TurnProfiler requested on the command line, or None if profiling is off."""
+    if not args.profile_dir:
+        return None
+    return TurnProfiler(
+        args.profile_dir,
+        sample_rate=args.profile_sample_rate,
+        latency_threshold=args.profile_threshold_ms / 1000 if args.profile_threshold_ms is not None else None,
+    )
@@ -1,16 +1,16 @@
 # Constants
 import os
 
-import httpx
 from function_calls import bedrock_agent_tool, get_bedrock_tools
 import json
-import requests
 
 WEATHER_API = "https://api.weather.gov"
 
 API_EMAIL = os.getenv("WEATHER_API_EMAIL")
 
 def submit_request(url: str) -> str:
+    import httpx
+
     headers = {
         "User-Agent": API_EMAIL,
     }
@@ -33,6 +33,8 @@ def get_weather(latitude: str, longitude:str) -> str:
         longitude: The longitude of the location in a string format (e.g.,"-74.0")
     """
 
+    import requests
+
     # Step 1: Get the forecast grid endpoint for these coordinates
     response = requests.get(f"https://api.weather.gov/points/{latitude},{longitude}")
     response.raise_for_status()  # Raise an exception for HTTP errors